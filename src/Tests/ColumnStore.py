@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+ColumnStore.py : Emmagatzematge columnar (struct-of-arrays) per a ImageData.
+
+En lloc d'un dict per imatge, guarda una columna per camp i assigna a cada
+UUID una fila. ImageData(columnar=True) l'utilitza en lloc del dict
+{UUID : {Data}}; els getters d'ImageData no canvien.
+
+Funcionalitat:
+    - Una llista per al prompt
+    - Codificació per diccionari per a model, sampler, generated i
+      created_date (pocs valors diferents): un array de codis per camp i la
+      llista dels valors diferents
+    - Columnes tipades per a seed (int64), steps (int16) i cfg_scale (float32),
+      convertides un sol cop en guardar-les
+    - array('I') per a l'id del path (PathTable) i per a width i height
+    - Recórrer un camp sencer (column()) sense tocar la resta de camps
+
+Mètodes:
+    - column(field: str, typed: bool = False) -> generator
+        Retorna (uuid, valor) per a cada imatge, en ordre d'inserció.
+        Amb typed=True, seed/steps/cfg_scale es retornen com a int/float
+        (None si falten o no són numèrics), iguals als de parse_number()
+        sobre el string original.
+
+    - select(field: str, predicate) -> list
+        Retorna els UUID (en ordre d'inserció) amb valor no None que compleix
+        predicate(valor). En els camps codificats per diccionari i en els
+        numèrics el predicat s'avalua un sol cop per valor diferent.
+
+    - value(uuid: str, field: str)
+        Retorna el valor d'un camp d'una imatge (KeyError si no hi és).
+
+    - export() -> dict
+        Retorna les columnes internes, sense files eliminades (Snapshot les
+        escriu a disc tal qual).
+
+Notes:
+    - Es comporta com un dict {uuid: fila}: store[uuid] retorna una vista
+      de només lectura de la fila i store[uuid] = {...} la substitueix
+    - Les dimensions (None, None) es guarden com a 0 (un PNG no pot mesurar 0)
+    - Els camps numèrics es continuen llegint com a strings idèntics als
+      originals: es formaten a demanda, i els valors que no es poden
+      reproduir exactament (p.ex. "7.0", "0042" o no numèrics) es guarden
+      també com a string a part
+    - Valor absent: INT64_MIN (seed), INT16_MIN (steps), NaN (cfg_scale)
+    - Les files eliminades queden buides i es compacten, mantenint l'ordre,
+      quan n'hi ha més de buides que de vives
+"""
+import math
+import struct
+from array import array
+from functools import lru_cache
+from collections.abc import Mapping, MutableMapping
+
+TEXT_FIELDS = ('prompt',)
+DICT_FIELDS = ('model', 'sampler', 'generated', 'created_date')  # Codi 0: None
+NUMERIC_FIELDS = {'seed': 'q', 'steps': 'h', 'cfg_scale': 'f'}  # camp -> typecode d'array
+FIELDS = ('file', 'prompt', 'model', 'seed', 'cfg_scale', 'steps', 'sampler', 'generated',
+          'created_date', 'dimensions')
+
+MISSING = {'seed': -2 ** 63, 'steps': -2 ** 15, 'cfg_scale': math.nan}
+
+_F32 = struct.Struct("f")
+_MEMO_SAMPLE = 4096  # select_numbers(): files que es miren abans de decidir si memoritzar
+
+
+def _to_f32(value: float) -> float:
+    return _F32.unpack(_F32.pack(value))[0]
+
+
+def _shortest_f32(value: float) -> str:
+    # El string més curt que torna a donar el mateix float32
+    for precision in range(1, 10):
+        text = "%.*g" % (precision, value)
+        if _to_f32(float(text)) == value:
+            return text
+    return repr(value)
+
+
+_shortest_f32_cached = lru_cache(maxsize=1 << 16)(_shortest_f32)
+
+
+def _format_f32(value: float) -> str:
+    # Memoritzat: cfg_scale té pocs valors diferents. 0.0 i -0.0 són la mateixa
+    # clau però s'escriuen diferent, i NaN no és igual a ell mateix: no es memoritzen
+    return _shortest_f32_cached(value) if value and value == value else _shortest_f32(value)
+
+
+def parse_number(field: str, text):
+    # Valor numèric del string, o None si no ho és
+    if text is None:
+        return None
+    try:
+        return float(text) if field == 'cfg_scale' else int(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def format_number(field: str, value) -> str:
+    return _format_f32(value) if field == 'cfg_scale' else str(value)
+
+
+def is_missing(field: str, value) -> bool:
+    return value != value if field == 'cfg_scale' else value == MISSING[field]
+
+
+def typed_number(field: str, value):
+    # Valor Python d'un número de la columna, igual que parse_number() del seu
+    # string: el float32 de cfg_scale es retorna com a 0.1 i no com a 0.10000000149
+    return float(_format_f32(value)) if field == 'cfg_scale' else value
+
+
+def select_numbers(field: str, column, raw: dict, predicate) -> list:
+    """
+    Files (en ordre) d'una columna numèrica amb valor no absent que compleix
+    predicate(valor com a string). raw és {fila: str} amb els valors guardats
+    com a string. Si hi ha pocs valors diferents (cfg_scale, steps), el
+    predicat s'avalua un sol cop per valor.
+    """
+    fmt = _format_f32 if field == 'cfg_scale' else str
+    matches = {}  # valor -> resultat del predicat
+    rows = []
+    start = 0
+    for start, value in enumerate(column):
+        if start >= _MEMO_SAMPLE and len(matches) > start // 2:
+            break  # Gairebé tots diferents (p.ex. seed): memoritzar no estalvia res
+        ok = matches.get(value) if value else None  # 0.0 i -0.0 s'escriuen diferent
+        if ok is None:
+            ok = not is_missing(field, value) and bool(predicate(fmt(value)))
+            if value:
+                matches[value] = ok
+        if ok:
+            rows.append(start)
+    else:
+        start = len(column)
+    missing = MISSING[field]
+    if field == 'cfg_scale':
+        rows += [row for row, value in enumerate(column[start:], start)
+                 if value == value and predicate(fmt(value))]
+    else:
+        rows += [row for row, value in enumerate(column[start:], start)
+                 if value != missing and predicate(fmt(value))]
+    if raw:
+        # Les files amb string propi substitueixen el resultat del valor numèric
+        rows = sorted({row for row in rows if row not in raw} |
+                      {row for row, text in raw.items() if predicate(text)})
+    return rows
+
+
+class Row(Mapping):
+    """Vista d'una fila de ColumnStore amb la mateixa forma que el dict d'ImageData."""
+
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store, row: int):
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, field: str):
+        return self._store._get(self._row, field)
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __str__(self):
+        return str(dict(self))
+
+
+class ColumnStore(MutableMapping):
+
+    __slots__ = ('_rows', '_uuids', '_file', '_width', '_height', '_text', '_codes', '_values',
+                 '_value_codes', '_num', '_raw', '_dead')
+
+    def __init__(self):
+        self._rows = {}              # uuid -> fila
+        self._uuids = []             # fila -> uuid (None si s'ha eliminat)
+        self._file = array('I')      # fila -> id del path (PathTable)
+        self._width = array('I')     # fila -> width (0 si no se sap)
+        self._height = array('I')    # fila -> height (0 si no se sap)
+        self._text = {field: [] for field in TEXT_FIELDS}  # camp -> fila -> str
+        self._codes = {field: array('I') for field in DICT_FIELDS}  # camp -> fila -> codi
+        self._values = {field: [None] for field in DICT_FIELDS}  # camp -> codi -> valor
+        self._value_codes = {field: {} for field in DICT_FIELDS}  # camp -> valor -> codi
+        self._num = {field: array(code) for field, code in NUMERIC_FIELDS.items()}  # camp -> fila -> valor
+        self._raw = {field: {} for field in NUMERIC_FIELDS}  # camp -> {fila: str} (no reproduïbles)
+        self._dead = 0               # files eliminades pendents de compactar
+
+    def _get(self, row: int, field: str):
+        if field == 'dimensions':
+            return (self._width[row] or None, self._height[row] or None)
+        if field == 'file':
+            return self._file[row]
+        if field in self._codes:
+            return self._values[field][self._codes[field][row]]
+        if field in self._num:
+            raw = self._raw[field].get(row)
+            if raw is not None:
+                return raw
+            value = self._num[field][row]
+            return None if is_missing(field, value) else format_number(field, value)
+        try:
+            return self._text[field][row]
+        except KeyError:
+            raise KeyError(field) from None
+
+    def _set_number(self, row: int, field: str, text) -> None:
+        column = self._num[field]
+        raw = self._raw[field]
+        raw.pop(row, None)
+        value = parse_number(field, text)
+        try:
+            column[row] = MISSING[field] if value is None else value
+        except OverflowError:
+            column[row] = MISSING[field]
+        stored = column[row]
+        if text is not None and (is_missing(field, stored) or format_number(field, stored) != text):
+            raw[row] = text
+
+    def _set(self, row: int, data: dict) -> None:
+        self._file[row] = data['file']
+        width, height = data.get('dimensions') or (None, None)
+        self._width[row] = width or 0
+        self._height[row] = height or 0
+        for field, column in self._text.items():
+            column[row] = data.get(field)
+        for field, column in self._codes.items():
+            column[row] = self._encode(field, data.get(field))
+        for field in self._num:
+            self._set_number(row, field, data.get(field))
+
+    def _encode(self, field: str, value) -> int:
+        if value is None:
+            return 0
+        codes = self._value_codes[field]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self._values[field])
+            self._values[field].append(value)
+        return code
+
+    def value(self, uuid: str, field: str):
+        return self._get(self._rows[uuid], field)
+
+    def select(self, field: str, predicate) -> list:
+        uuids = self._uuids
+        if field in self._codes:
+            # Un sol cop per valor diferent; després només es comparen codis
+            matches = {code for code, value in enumerate(self._values[field])
+                       if value is not None and predicate(value)}
+            if not matches:
+                return []
+            return [uuids[row] for row, code in enumerate(self._codes[field])
+                    if code in matches and uuids[row] is not None]
+        if field in self._num:
+            return [uuids[row] for row in select_numbers(field, self._num[field], self._raw[field], predicate)
+                    if uuids[row] is not None]
+        return [uuid for uuid, value in self.column(field) if value is not None and predicate(value)]
+
+    def column(self, field: str, typed: bool = False):
+        uuids = self._uuids
+        if field in self._codes:
+            values = map(self._values[field].__getitem__, self._codes[field])
+        elif field in self._num:
+            # Es llegeix l'array directament; les excepcions són al dict raw
+            raw = self._raw[field]
+            missing = is_missing
+            if typed:
+                number = typed_number
+                values = (parse_number(field, raw[row]) if row in raw else None if missing(field, value)
+                          else number(field, value) for row, value in enumerate(self._num[field]))
+            else:
+                fmt = _format_f32 if field == 'cfg_scale' else str
+                values = (raw[row] if row in raw else None if missing(field, value) else fmt(value)
+                          for row, value in enumerate(self._num[field]))
+        elif field == 'dimensions':
+            values = (self._get(row, field) for row in range(len(uuids)))
+        elif field == 'file':
+            values = self._file
+        else:
+            values = self._text[field]
+        for uuid, value in zip(uuids, values):
+            if uuid is not None:
+                yield uuid, value
+
+    def export(self) -> dict:
+        if self._dead:
+            self._compact()
+        return {'uuids': self._uuids, 'file': self._file, 'width': self._width, 'height': self._height,
+                'text': self._text, 'codes': self._codes, 'values': self._values,
+                'num': self._num, 'raw': self._raw}
+
+    def __getitem__(self, uuid: str) -> Row:
+        return Row(self, self._rows[uuid])
+
+    def __setitem__(self, uuid: str, data: dict) -> None:
+        row = self._rows.get(uuid)
+        if row is None:
+            row = len(self._uuids)
+            self._rows[uuid] = row
+            self._uuids.append(uuid)
+            self._file.append(0)
+            self._width.append(0)
+            self._height.append(0)
+            for column in self._text.values():
+                column.append(None)
+            for column in self._codes.values():
+                column.append(0)
+            for field, column in self._num.items():
+                column.append(MISSING[field])
+        self._set(row, data)
+
+    def __delitem__(self, uuid: str) -> None:
+        row = self._rows.pop(uuid)
+        self._uuids[row] = None
+        for column in self._text.values():
+            column[row] = None  # Allibera els strings
+        for column in self._codes.values():
+            column[row] = 0
+        for raw in self._raw.values():
+            raw.pop(row, None)
+        self._dead += 1
+        if self._dead > len(self._rows):
+            self._compact()
+
+    def _compact(self) -> None:
+        keep = [row for row, uuid in enumerate(self._uuids) if uuid is not None]
+        self._uuids = [self._uuids[row] for row in keep]
+        self._file = array('I', (self._file[row] for row in keep))
+        self._width = array('I', (self._width[row] for row in keep))
+        self._height = array('I', (self._height[row] for row in keep))
+        for field, column in self._text.items():
+            self._text[field] = [column[row] for row in keep]
+        for field, column in self._codes.items():
+            self._codes[field] = array('I', (column[row] for row in keep))
+        new_row = {row: i for i, row in enumerate(keep)}
+        for field, column in self._num.items():
+            self._num[field] = array(column.typecode, (column[row] for row in keep))
+            self._raw[field] = {new_row[row]: text for row, text in self._raw[field].items()}
+        self._rows = {uuid: row for row, uuid in enumerate(self._uuids)}
+        self._dead = 0
+
+    def __contains__(self, uuid) -> bool:
+        return uuid in self._rows
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __str__(self):
+        return f'ColumnStore: {len(self._rows)} imatges'
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+ImageArchive.py : Col·lecció d'imatges continguda dins un arxiu tar o zip.
+
+Permet incorporar a ImageID/ImageData les imatges d'un tarball (.tar, .tar.gz,
+.tgz, ...) o d'un .zip sense haver-lo d'extreure a ROOT_DIR.
+
+Funcionalitat:
+    - Recórrer els membres PNG de l'arxiu en una sola passada (streaming)
+    - Llegir només els chunks de capçalera de cada PNG (IHDR, tEXt, iTXt)
+    - Registrar les imatges amb un path canònic qualificat per l'arxiu
+
+Mètodes:
+    - scan(headers_only: bool = False, members: set = None) -> generator
+        Retorna (path, metadata, (width, height)) per a cada PNG de l'arxiu.
+        Si es dona members (noms dins l'arxiu), només es llegeixen aquests i
+        la passada s'acaba en trobar l'últim.
+
+    - load(image_id: ImageID, image_data: ImageData, headers_only: bool = False) -> list
+        Genera l'UUID de cada PNG, l'afegeix a image_data amb les seves
+        metadades i retorna la llista d'UUID.
+
+    - files_added() -> list
+        Retorna els paths qualificats trobats a l'última passada.
+
+Notes:
+    - El path d'un membre és "<arxiu canònic>!/<membre>",
+      p.ex. "bundles/set_01.tar.gz!/images/img_0001.png"; el nom del membre
+      es normalitza (sense "/" inicial ni "./"), com faria ImageID amb el path
+    - ImageData reconeix aquests paths i llegeix el membre directament de
+      l'arxiu quan se li demana load_metadata(); load_all_metadata() llegeix
+      tots els membres demanats d'un mateix arxiu en una sola passada
+"""
+import os
+import posixpath
+import tarfile
+import zipfile
+import cfg
+
+ARCHIVE_SEP = "!/"
+
+
+def split_archive_path(path: str) -> tuple:
+    """Separa un path qualificat en (arxiu, membre). Si no ho és, retorna (path, None)."""
+    archive, sep, member = path.partition(ARCHIVE_SEP)
+    if not sep:
+        return path, None
+    return archive, member
+
+
+def normalize_member(name: str) -> str:
+    """Nom d'un membre tal com apareix als paths qualificats ("./img/x.png" -> "img/x.png")."""
+    return posixpath.normpath(name.lstrip("/"))
+
+
+def _original_name(names, member: str) -> str:
+    # Nom real dins l'arxiu del membre normalitzat (p.ex. creat amb "tar -C dir .")
+    if member in names:
+        return member
+    for name in names:
+        if normalize_member(name) == member:
+            return name
+    raise KeyError(member)
+
+
+def read_archive_member(archive: str, member: str, headers_only: bool = False) -> tuple:
+    """Llegeix metadades i dimensions d'un sol membre PNG d'un arxiu tar o zip."""
+    try:
+        if zipfile.is_zipfile(archive):
+            with zipfile.ZipFile(archive) as zf:
+                with zf.open(_original_name(zf.namelist(), member)) as f:
+                    return cfg.read_png_stream(f, headers_only)
+        with tarfile.open(archive, "r:*") as tf:
+            f = tf.extractfile(_original_name(tf.getnames(), member))
+            if f is None:
+                return {}, (None, None)
+            with f:
+                return cfg.read_png_stream(f, headers_only)
+    except (KeyError, OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+        print(f"ERROR llegint {member} de {archive}: {e}")
+        return None, (None, None)
+
+
+class ImageArchive:
+    def __init__(self, archive: str):
+        root = cfg.get_root()
+        abs_path = archive if os.path.isabs(archive) else os.path.join(root, archive)
+        self._archive = os.path.realpath(abs_path)
+        self._canon = cfg.get_canonical_pathfile(self._archive)
+        self._files = []
+
+        if not os.path.isfile(self._archive):
+            raise FileNotFoundError(f"No s'ha trobat l'arxiu: {self._archive}")
+
+    def _qualify(self, member: str) -> str:
+        return self._canon + ARCHIVE_SEP + normalize_member(member)
+
+    def _members(self, members=None):
+        # Yields (nom del membre, file binari) de cada PNG, en l'ordre de l'arxiu
+        def wanted(name):
+            return name.lower().endswith(".png") and (members is None or normalize_member(name) in members)
+
+        if zipfile.is_zipfile(self._archive):
+            with zipfile.ZipFile(self._archive) as zf:
+                for info in zf.infolist():
+                    if not info.is_dir() and wanted(info.filename):
+                        with zf.open(info) as f:
+                            yield info.filename, f
+        else:
+            # Mode stream ("r|*"): una sola passada seqüencial, també per a .tar.gz
+            with tarfile.open(self._archive, "r|*") as tf:
+                for info in tf:
+                    if info.isfile() and wanted(info.name):
+                        f = tf.extractfile(info)
+                        if f is not None:
+                            yield info.name, f
+
+    def scan(self, headers_only: bool = False, members: set = None):
+        files = []
+        remaining = None if members is None else set(members)
+        for member, f in self._members(remaining):
+            path = self._qualify(member)
+            metadata, dimensions = cfg.read_png_stream(f, headers_only)
+            files.append(path)
+            yield path, metadata, dimensions
+            if remaining is not None:
+                remaining.discard(normalize_member(member))
+                if not remaining:
+                    break  # Ja s'han trobat tots: no cal descomprimir la resta
+        self._files = sorted(files)
+
+    def load(self, image_id, image_data, headers_only: bool = False) -> list:
+        uuids = []
+        for path, metadata, dimensions in self.scan(headers_only):
+            uuid = image_id.generate_uuid(path)
+            if uuid is None:
+                continue
+            try:
+                image_data.add_image(uuid, path)
+            except KeyError:
+                pass  # Ja registrada: n'actualitzem les metadades
+            if metadata is not None:
+                image_data.store_metadata(uuid, metadata, dimensions)
+            uuids.append(uuid)
+        return uuids
+
+    def files_added(self) -> list:
+        return list(self._files)
+
+    def __str__(self):
+        return f'ImageArchive: {self._canon} ({len(self._files)} imatges)'
+
+    def __len__(self):
+        return len(self._files)
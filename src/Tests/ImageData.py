@@ -49,28 +49,136 @@ Mètodes a implementar:
     - get_dimensions(uuid: str) -> tuple
         Retorna una tupla (width, height) amb les dimensions de la imatge.
 
+    - get_record(uuid: str, fields: tuple = RECORD_FIELDS) -> namedtuple
+        Retorna els camps demanats d'una imatge d'un sol cop, amb els mateixos
+        valors que els getters (strings, dimensions com a tupla).
+
+    - get_records(uuids: list, fields: tuple = RECORD_FIELDS) -> list
+        Com get_record() per a una llista d'UUID.
+
+    - get_uuids(files: list) -> list
+        Com get_uuid() per a una llista d'arxius (None si un arxiu no hi és).
+
+    - select(field: str, predicate) -> list
+        Retorna els UUID amb valor del camp no None que compleix predicate(valor).
+
+    - iter_field(field: str, typed: bool = False) -> generator
+        Retorna (uuid, valor) del camp per a totes les imatges. Amb typed=True
+        seed, steps i cfg_scale es retornen com a int/float (None si falten).
+
+    - prefetch(uuids: list = None, **kwargs) -> None
+        Carrega ara (per blocs, com load_all_metadata) les metadades encara no
+        llegides de les imatges indicades (totes si uuids és None). Si en
+        queden poques, es llegeixen directament, sense pool de threads.
+
+    - save_snapshot(path: str) -> None
+        Guarda tot el catàleg en un snapshot binari columnar (Snapshot.py).
+
+    - ImageData.open_snapshot(path: str, **kwargs) -> ImageData
+        Obre un snapshot amb mmap: el catàleg es pot consultar de seguida,
+        sense recórrer el filesystem ni llegir cap PNG. La primera
+        modificació el copia a un ColumnStore en memòria.
+
+    - get_Image_Data() -> dict
+        Retorna una còpia {UUID : {Data}} de la col·lecció, amb 'file' com a
+        path relatiu, tant si les dades són en un dict, en columnes o en un snapshot.
+
+    - ImageData(lazy=True) no necessita load_metadata(): el primer getter
+      d'una imatge no carregada en llegeix la capçalera (i ja queda en memòria)
+    - ImageData(columnar=True) guarda les dades en columnes (ColumnStore)
+      en lloc d'un dict per imatge; la resta de l'API no canvia
 
     - Tots els camps de metadades es guarden com a strings
 """
 import json
+from collections import namedtuple
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from typing import Dict
 import cfg
 import os
+import stat
+import tarfile
+import zipfile
+from MetadataCache import MetadataCache
+from ImageArchive import ImageArchive, normalize_member, split_archive_path, read_archive_member
+import PathTable
+from ColumnStore import ColumnStore, NUMERIC_FIELDS, parse_number
+from Snapshot import SnapshotStore, write_snapshot
+
+
+RECORD_FIELDS = ('file', 'prompt', 'model', 'seed', 'cfg_scale', 'steps', 'sampler',
+                 'generated', 'created_date', 'dimensions')
+
+
+@lru_cache(maxsize=None)
+def _record_type(fields: tuple):
+    # Una classe namedtuple per combinació de camps
+    return namedtuple('ImageRecord', fields)
+
+
+def _stat_file(file: str):
+    # Un sol stat: retorna None si l'arxiu no existeix o no és un arxiu regular
+    try:
+        st = os.stat(file)
+    except OSError:
+        return None
+    return st if stat.S_ISREG(st.st_mode) else None
+
+
+def _abs_path(filepath: str) -> str:
+    root = cfg.get_root()
+    path = cfg.get_canonical_pathfile(os.path.join(root, filepath)).replace('../', '')
+    return os.path.realpath(os.path.join(root, path))
+
+
+def _read_path(filepath: str):
+    # Worker de load_all_metadata sense cache: la resolució del path i el stat
+    # també es fan al pool. None si l'arxiu ja no hi és
+    file = _abs_path(filepath)
+    if _stat_file(file) is None:
+        return None
+    return cfg.read_png_info(file)
 
 
 class ImageData:
 
-    __slots__ = '_image_data'
-    def __init__(self):
-        self._image_data: Dict[str, Dict] = {} # {UUID : {Data}} 
+    __slots__ = ('_image_data', '_cache', '_paths', '_file2uuid', '_lazy', '_unloaded')
+    _DIRECT_LOAD = 4  # prefetch(): fins a aquí, es llegeix sense pool de threads
+    def __init__(self, metadata_cache: MetadataCache = None, path_table: PathTable.PathTable = None,
+                 columnar: bool = False, lazy: bool = False):
+        # {UUID : {Data}} ('file' és un id de PathTable), o el mateix en columnes
+        self._image_data: Dict[str, Dict] = ColumnStore() if columnar else {}
+        self._cache = metadata_cache # Cache persistent opcional de metadades
+        self._paths = path_table or PathTable.shared()
+        self._file2uuid = {}  # Índex invers: id del path -> UUID
+        self._lazy = lazy  # Llegir les metadades al primer accés
+        self._unloaded = set()  # UUID afegits (mode lazy) que encara no s'han llegit
 
     def __iter__(self):
         return self._image_data.__iter__()
 
+    def _writable(self) -> None:
+        # Un snapshot és de només lectura: es copia a un ColumnStore abans de modificar-lo
+        snapshot = self._image_data
+        if isinstance(snapshot, SnapshotStore):
+            store = ColumnStore()
+            for uuid in snapshot:
+                store[uuid] = snapshot[uuid]
+            for uuid, path_id in store.column('file'):
+                self._file2uuid.setdefault(path_id, uuid)
+            self._image_data = store
+            snapshot.close()
+
     def add_image(self, uuid: str, file: str) -> None:
         if uuid not in self._image_data.keys():
+            self._writable()
+            path_id = self._paths.add(file)
+            self._file2uuid.setdefault(path_id, uuid)
+            if self._lazy:
+                self._unloaded.add(uuid)
             self._image_data[uuid] = {
-                'file': file,
+                'file': path_id,
                 'prompt': None,
                 'model': None,
                 'seed': None,
@@ -89,30 +197,24 @@ class ImageData:
         if uuid not in self._image_data.keys():
             raise KeyError("No image found to remove with UUID:", uuid)
 
+        self._writable()
+        path_id = self._image_data[uuid]['file']
+        if self._file2uuid.get(path_id) == uuid:
+            del self._file2uuid[path_id]
+        self._unloaded.discard(uuid)
+
         del self._image_data[uuid]
 
-    def load_metadata(self, uuid: str) -> None:
+    def _file(self, uuid: str) -> str:
+        return self._paths.path(self._image_data[uuid]['file'])
 
-        if uuid not in self._image_data.keys():
-            raise KeyError(f"Image with UUID {uuid} not found in collection.")
-        
-        dades = self._image_data[uuid]
-        filepath = dades['file']
-        root = cfg.get_root()
-        path = cfg.get_canonical_pathfile(os.path.join(cfg.get_root(), filepath)).replace('../', '')
-        file = os.path.realpath(os.path.join(root, path))
-        
-        metadata = {}
-        dimensions = (None, None)
-        if not os.path.isdir(file) and os.path.exists(file):
-            try:
-                metadata = cfg.read_png_metadata(file)
-                dimensions = cfg.get_png_dimensions(file)
-            except AttributeError as e:
-                raise AttributeError(f"Error reading metadata/dimensions for {filepath}: {e}")
-            
-                
+    def _abs_path(self, filepath: str) -> str:
+        return _abs_path(filepath)
+
+    def store_metadata(self, uuid: str, metadata: dict, dimensions: tuple) -> None:
+        self._unloaded.discard(uuid)
         if metadata:
+            self._writable()
             prompt = metadata.get('Prompt', metadata.get('prompt', None))
             model = metadata.get('Model', metadata.get('model', None))
             seed = metadata.get('Seed', metadata.get('seed', None))
@@ -124,7 +226,7 @@ class ImageData:
     
 
             self._image_data[uuid] = {
-                'file': filepath,
+                'file': self._image_data[uuid]['file'],
                 'prompt': prompt,
                 'model': model,
                 'seed': seed,
@@ -136,9 +238,159 @@ class ImageData:
                 'dimensions': dimensions
 
             }
+
+    def _read_file(self, file: str) -> tuple:
+        st = _stat_file(file)
+        if st is None:
+            return {}, (None, None)
+
+        if self._cache is not None:
+            cached = self._cache.get(file, st)
+            if cached is not None:
+                return cached
+
+        metadata, dimensions = cfg.read_png_info(file)
+        if self._cache is not None and metadata is not None:
+            self._cache.put(file, st, metadata, dimensions)
+        return metadata, dimensions
+
+    def read_metadata(self, uuid: str) -> tuple:
+        # Només llegeix (no modifica la col·lecció): es pot cridar des d'altres threads
+        if uuid not in self._image_data.keys():
+            raise KeyError(f"Image with UUID {uuid} not found in collection.")
+
+        filepath = self._file(uuid)
+        try:
+            archive, member = split_archive_path(filepath)
+            if member is not None:
+                # Imatge dins un tar/zip: es llegeix el membre sense extreure'l
+                return read_archive_member(self._abs_path(archive), member)
+            return self._read_file(self._abs_path(filepath))
+        except AttributeError as e:
+            raise AttributeError(f"Error reading metadata/dimensions for {filepath}: {e}")
+
+    def load_metadata(self, uuid: str) -> None:
+        metadata, dimensions = self.read_metadata(uuid)
+        self.store_metadata(uuid, metadata, dimensions)
+
+    def _load_archive_members(self, archive: str, members: dict) -> None:
+        # Una sola passada per arxiu: obrir-lo per a cada membre descomprimiria
+        # un .tar.gz sencer un cop per imatge
+        missing = set(members)
+        try:
+            for path, metadata, dimensions in ImageArchive(self._abs_path(archive)).scan(members=missing):
+                member = split_archive_path(path)[1]
+                missing.discard(member)
+                for uuid in members[member]:
+                    self.store_metadata(uuid, metadata, dimensions)
+        except (OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+            print(f"ERROR llegint {archive}: {e}")
+            return
+        for member in missing:
+            print(f"ERROR llegint {member} de {archive}: no és a l'arxiu")
+
+    def load_all_metadata(self, uuids=None, workers: int = None, backend: str = "thread",
+                          chunk_size: int = 256) -> None:
+        """
+        Carrega les metadades de moltes imatges alhora repartint la lectura dels
+        PNG entre un pool de threads ("thread") o de processos ("process").
+
+        Els resultats s'incorporen a la col·lecció per blocs de chunk_size.
+        Si uuids és None, es carreguen totes les imatges de la col·lecció.
+        """
+        if backend == "thread":
+            executor_cls = ThreadPoolExecutor
+        elif backend == "process":
+            executor_cls = ProcessPoolExecutor
+        else:
+            raise ValueError(f"Backend desconegut: {backend} (ha de ser 'thread' o 'process')")
+
+        uuids = list(self._image_data) if uuids is None else list(uuids)
+        for uuid in uuids:
+            if uuid not in self._image_data:
+                raise KeyError(f"Image with UUID {uuid} not found in collection.")
+
+        # Amb cache, les imatges que ja hi són no cal llegir-les (cal el stat
+        # abans); sense cache, el path es resol i es comprova dins el pool
+        pending = []  # [(uuid, file, stat)]
+        archives = {}  # arxiu -> {membre: [uuid]}
+        for uuid in uuids:
+            filepath = self._file(uuid)
+            archive, member = split_archive_path(filepath)
+            if member is not None:
+                archives.setdefault(archive, {}).setdefault(normalize_member(member), []).append(uuid)
+                continue
+            if self._cache is None:
+                pending.append((uuid, filepath, None))
+                continue
+            file = self._abs_path(filepath)
+            st = _stat_file(file)
+            if st is None:
+                continue
+            cached = self._cache.get(file, st)
+            if cached is not None:
+                self.store_metadata(uuid, *cached)
+            else:
+                pending.append((uuid, file, st))
+
+        for archive, members in archives.items():
+            self._load_archive_members(archive, members)
+
+        read = cfg.read_png_info if self._cache is not None else _read_path
+        blocks = [pending[start:start + chunk_size] for start in range(0, len(pending), chunk_size)]
+        with executor_cls(max_workers=workers) as executor:
+            def submit(block):
+                # Als processos, cada bloc es reparteix en un missatge per worker
+                per_task = max(1, len(block) // (workers or os.cpu_count() or 1)) if backend == "process" else 1
+                return executor.map(read, [file for _, file, _ in block], chunksize=per_task)
+
+            results = submit(blocks[0]) if blocks else None
+            for i, block in enumerate(blocks):
+                # El bloc següent ja es llegeix mentre s'incorpora aquest
+                current, results = results, submit(blocks[i + 1]) if i + 1 < len(blocks) else None
+                for (uuid, file, st), result in zip(block, current):
+                    if result is None:
+                        continue  # Ja no existeix
+                    metadata, dimensions = result
+                    if self._cache is not None and metadata is not None:
+                        self._cache.put(file, st, metadata, dimensions)
+                    self.store_metadata(uuid, metadata, dimensions)
+
+        if self._cache is not None:
+            self._cache.flush()
+        self._unloaded.difference_update(uuids)
+
+    def prefetch(self, uuids=None, **kwargs) -> None:
+        pending = list(self._unloaded if uuids is None else self._unloaded.intersection(uuids))
+        if len(pending) <= self._DIRECT_LOAD:
+            # Per a poques imatges (p.ex. get_record) no val la pena crear un pool
+            for uuid in pending:
+                self.load_metadata(uuid)
+        else:
+            self.load_all_metadata(pending, **kwargs)
+
+    def refresh_modified(self, image_files, image_id, **kwargs) -> list:
+        """
+        Torna a llegir les metadades només de les imatges que image_files ha
+        detectat com a modificades (files_modified()) a l'últim reload_fs().
+
+        Els kwargs es passen a load_all_metadata (workers, backend, ...).
+        Retorna la llista d'UUID actualitzats.
+        """
+        uuids = []
+        for file in image_files.files_modified():
+            uuid = image_id.get_uuid(file)
+            if uuid is not None and uuid in self._image_data:
+                uuids.append(uuid)
+        if uuids:
+            self.load_all_metadata(uuids, **kwargs)
+        return uuids
+
     def _get_metadata_field(self, uuid: str, field: str) -> str:
         if uuid not in self._image_data.keys():
             raise KeyError(f"Image with UUID {uuid} not found.")
+        if uuid in self._unloaded:
+            self.load_metadata(uuid)
         if field not in self._image_data[uuid]:
             raise KeyError(f"Field '{field}' not found for image with UUID {uuid}.")
         
@@ -166,8 +418,40 @@ class ImageData:
                 cotas_querys['fantasy'] += 1
         return cotas_querys
 
+    def get_record(self, uuid: str, fields: tuple = RECORD_FIELDS) -> tuple:
+        return self.get_records([uuid], fields)[0]
+
+    def get_records(self, uuids: list, fields: tuple = RECORD_FIELDS) -> list:
+        fields = tuple(fields)
+        for field in fields:
+            if field not in RECORD_FIELDS:
+                raise KeyError(f"Field '{field}' not found.")
+        record = _record_type(fields)
+        uuids = list(uuids)
+        for uuid in uuids:
+            if uuid not in self._image_data:
+                raise KeyError(f"Image with UUID {uuid} not found.")
+        if self._unloaded:
+            self.prefetch(uuids)
+
+        records = []
+        for uuid in uuids:
+            data = self._image_data[uuid]  # Una sola consulta per imatge
+            values = []
+            for field in fields:
+                value = data[field]
+                if field == 'file':
+                    value = self._paths.path(value)
+                elif field != 'dimensions':
+                    value = str(value)
+                values.append(value)
+            records.append(record._make(values))
+        return records
+
     def get_file(self, uuid:str):
-        return self._get_metadata_field(uuid, 'file')
+        if uuid not in self._image_data.keys():
+            raise KeyError(f"Image with UUID {uuid} not found.")
+        return self._file(uuid)
 
     def get_prompt(self, uuid: str) -> str:
         return self._get_metadata_field(uuid, 'prompt')
@@ -196,23 +480,78 @@ class ImageData:
     def get_dimensions(self, uuid: str) -> tuple:
         if uuid not in self._image_data:
             raise KeyError("No image found with UUID:", uuid)
+        if uuid in self._unloaded:
+            self.load_metadata(uuid)
         return self._image_data[uuid]['dimensions']
     
     def get_uuid(self, file: str) -> str:
-        for uuid in self._image_data:   
-            if self._image_data[uuid]['file'] == file:
-                return uuid
-        raise KeyError("No image found with file:", file)
+        if isinstance(self._image_data, SnapshotStore):
+            uuid = self._image_data.find_file(file)
+        else:
+            path_id = self._paths.find(file)
+            uuid = self._file2uuid.get(path_id) if path_id is not None else None
+        if uuid is None:
+            raise KeyError("No image found with file:", file)
+        return uuid
+
+    def get_uuids(self, files: list) -> list:
+        if isinstance(self._image_data, SnapshotStore):
+            return [self._image_data.find_file(file) for file in files]
+        find = self._paths.find
+        index = self._file2uuid
+        return [index.get(find(file)) for file in files]
+
+    def select(self, field: str, predicate) -> list:
+        if field != 'file' and self._unloaded:
+            self.prefetch()
+        if isinstance(self._image_data, (ColumnStore, SnapshotStore)):
+            # En els camps codificats per diccionari, un cop per valor diferent
+            return self._image_data.select(field, predicate)
+        return [uuid for uuid, value in self.iter_field(field) if value is not None and predicate(value)]
+
+    def iter_field(self, field: str, typed: bool = False):
+        if field != 'file' and self._unloaded:
+            self.prefetch()
+        typed = typed and field in NUMERIC_FIELDS
+        if isinstance(self._image_data, (ColumnStore, SnapshotStore)):
+            # Recorre només la columna del camp (ja tipada en el cas numèric)
+            return self._image_data.column(field, typed)
+        if typed:
+            return ((uuid, parse_number(field, data[field])) for uuid, data in self._image_data.items())
+        return ((uuid, data[field]) for uuid, data in self._image_data.items())
     
      
-    def get_Image_Data(self):
-        return self._image_data
+    def save_snapshot(self, path: str) -> None:
+        if self._unloaded:
+            self.prefetch()
+        store = self._image_data
+        if not isinstance(store, ColumnStore):
+            store = ColumnStore()
+            for uuid, data in self._image_data.items():
+                store[uuid] = data
+        write_snapshot(path, store.export(), self._paths)
+
+    @classmethod
+    def open_snapshot(cls, path: str, **kwargs) -> "ImageData":
+        image_data = cls(**kwargs)
+        image_data._image_data = SnapshotStore(path, image_data._paths)
+        return image_data
+
+    def get_Image_Data(self) -> dict:
+        # Còpia en el format original {UUID : {Data}}, amb 'file' com a path
+        # (sigui quin sigui l'emmagatzematge intern)
+        if self._unloaded:
+            self.prefetch()
+        return {uuid: dict(self._image_data[uuid], file=self._file(uuid)) for uuid in self._image_data}
     
     
     def __str__(self):
+        if self._unloaded:
+            self.prefetch()
         msg = ''
         for uuid in self._image_data:
-            msg += (f'- UUID : {uuid} | Path relatiu: {self._image_data[uuid]} \n')
+            data = dict(self._image_data[uuid], file=self._file(uuid))
+            msg += (f'- UUID : {uuid} | Path relatiu: {data} \n')
         
         return msg
  
@@ -26,16 +26,73 @@ Notes:
     - Els paths han de ser sempre relatius a ROOT_DIR
     - Només considereu arxius amb extensió .png (case-insensitive)
     - Heu de recórrer tots els subdirectoris recursivament
+    - reload_fs() és incremental: només torna a llistar els directoris amb
+      st_mtime_ns diferent de l'última lectura, o modificats poc abans
+      d'aquesta lectura (granularitat del mtime de NFS, SMB, ext3, ...)
+    - ImageFiles(workers=N) reparteix els directoris entre N threads, útil
+      en filesystems de xarxa on cada readdir té molta latència
+    - Amb watch() (Linux) reload_fs() consumeix els events d'inotify en lloc
+      de recórrer el filesystem
+    - save_manifest()/load_manifest() guarden i recuperen l'últim escaneig
+      (cfg.FILES_MANIFEST), perquè un procés nou només vegi els canvis reals
+    - Amb track_modified=True, files_modified() retorna els arxius reescrits
+      (ImageData.refresh_modified() en torna a llegir només les metadades)
+    - L'estat intern guarda ids de PathTable (compartida amb ImageID i
+      ImageData), no strings: els mètodes públics continuen retornant paths
+    - La PathTable no s'encongeix mai: en un procés de llarga durada amb
+      watch() on passen molts arxius temporals, és millor donar una taula
+      pròpia del catàleg (path_table=PathTable.PathTable()) que la compartida
 """
 
 import os
+import struct
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import cfg
+import Inotify as inotify
+from Inotify import Inotify
+import PathTable
+
+# Manifest: capçalera (magic, versió, nombre d'entrades) i, per a cada arxiu,
+# longitud del path (utf-8), mida, st_mtime_ns, inode i path
+_MANIFEST_MAGIC = b"IMFM"
+_MANIFEST_VERSION = 2
+_MANIFEST_HEADER = struct.Struct("<4sIQ")
+_MANIFEST_ENTRY = struct.Struct("<IQqQ")
+
+# Granularitat del mtime més gruixuda que es té en compte (FAT: 2 s; NFS, SMB, ext3: 1 s)
+_RACY_NS = 2 * 10 ** 9
+
+
+def _file_signature(path: str) -> tuple:
+    # (mida, st_mtime_ns, inode) o None si l'arxiu ja no hi és
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
 
 class ImageFiles:
-    def __init__(self):
-        self._prev = set()
-        self._added = []
-        self._removed = []
+    def __init__(self, workers: int = 1, track_modified: bool = False, use_inode: bool = False,
+                 path_table: PathTable.PathTable = None):
+        self._paths = path_table or PathTable.shared()
+        self._workers = workers  # Threads per recórrer directoris en paral·lel
+        self._track_modified = track_modified  # stat de cada .png a cada reload_fs()
+        self._use_inode = use_inode  # Un canvi d'inode també compta com a modificació
+        self._prev = set()  # ids (PathTable) dels pngs coneguts
+        self._added = array('I')  # ids dels canvis de l'últim reload_fs(); els paths es fan a files_*()
+        self._removed = array('I')
+        self._modified = array('I')
+        self._found_modified = set()
+        self._dirs = {}  # dirpath -> (st_mtime_ns, ids dels pngs, subdirectoris)
+        self._watcher = None  # Inotify (mode watch)
+        self._watch_root = None
+        self._pending_added = set()
+        self._pending_removed = set()
+        self._undelivered = (set(), set(), set(), False)  # Events llegits i no lliurats (mode watch)
+        self._stats = {}  # id del path -> (mida, st_mtime_ns, inode)
+        self._full_diff = False  # El proper reload_fs() ha de comparar-ho tot (manifest)
 
     """
     def reload_fs(self, path: str = None) -> None:
@@ -65,37 +122,429 @@ class ImageFiles:
 
     """ 
 
-    def reload_fs(self, path: str = None) -> None:
-        # Determinar raíz
+    def _scan_dir(self, dirpath: str) -> tuple:
+        # Llista un directori amb os.scandir: (ids dels pngs, subdirectoris)
+        canon_dir = cfg.get_canonical_pathfile(dirpath)
+        prefix = "" if canon_dir == "." else canon_dir + "/"
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        # Com os.walk: no seguim els enllaços simbòlics a directoris
+                        if not entry.is_symlink():
+                            subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(".png"):
+                        files.append(self._paths.add_in_dir(prefix, entry.name))
+        except OSError:
+            pass
+        return tuple(files), tuple(subdirs)
+
+    def _resolve_root(self, path: str = None) -> str:
         if path is None:
-            root = cfg.get_root()
+            return cfg.get_root()
+        root = path
+        if not os.path.isabs(root):
+            root = os.path.join(cfg.get_root(), root)
+        return root
+
+    def _visit_dir(self, dirpath: str) -> tuple:
+        # (st_mtime_ns, pngs, subdirectoris); només es torna a llistar si ha canviat
+        try:
+            mtime = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            return None, None
+        entry = self._dirs.get(dirpath)
+        if entry is None or entry[0] != mtime:
+            listed = time.time_ns()
+            files, subdirs = self._scan_dir(dirpath)
+            # Llistat "racy" (com l'índex de git): si el directori ha canviat
+            # dins la granularitat del mtime, un arxiu creat just després del
+            # llistat no el canviaria. Sense mtime, es torna a llistar la propera vegada
+            racy = listed - mtime < _RACY_NS
+            entry = (None if racy else mtime, files, subdirs)
+
+        # Modificar un arxiu no canvia el mtime del directori: cal un stat per arxiu
+        sigs = None
+        if self._track_modified:
+            sigs = [_file_signature(os.path.join(dirpath, self._paths.name(pid))) for pid in entry[1]]
+        return entry, sigs
+
+    def _is_modified(self, old: tuple, new: tuple) -> bool:
+        if old[0] != new[0] or old[1] != new[1]:
+            return True
+        return self._use_inode and old[2] != 0 and old[2] != new[2]
+
+    def _walk_diff(self, root: str) -> tuple:
+        # Recorregut complet (sense generador), aplicat a l'estat
+        walker = self._iter_walk_diff(root)
+        while True:
+            try:
+                next(walker)
+            except StopIteration as stop:
+                added, removed, walk = stop.value
+                self._apply_walk(walk)
+                return self._commit(added, removed)
+
+    def _iter_walk_diff(self, root: str):
+        # Generador: retorna cada .png nou tan aviat com es troba i, en acabar,
+        # (added, removed, walk) com a valor de retorn. No modifica l'estat:
+        # walk (llistats i signatures) s'aplica amb _apply_walk()
+        added = set()
+        removed = set()
+        visited = {}
+        stats = {}
+
+        def record(dirpath, entry, sigs):
+            found = ()
+            cached = self._dirs.get(dirpath)
+            if entry is not cached:
+                old_files = set(cached[1]) if cached is not None else set()
+                new_files = set(entry[1])
+                found = new_files - old_files
+                added.update(found)
+                removed.update(old_files - new_files)
+            visited[dirpath] = entry
+            if sigs is not None:
+                for pid, sig in zip(entry[1], sigs):
+                    if sig is None:
+                        continue
+                    old = self._stats.get(pid)
+                    if old is not None and self._is_modified(old, sig):
+                        self._found_modified.add(pid)
+                    stats[pid] = sig
+            return [self._paths.path(pid) for pid in found if pid not in self._prev]
+
+        # Recórrer el filesystem: només es tornen a llistar els directoris
+        # que han canviat (st_mtime_ns diferent) des de l'última lectura
+        if self._workers > 1:
+            # Cada directori és una tasca: els readdir lents se solapen
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                futures = {executor.submit(self._visit_dir, root): root}
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        dirpath = futures.pop(future)
+                        entry, sigs = future.result()
+                        if entry is None:
+                            continue
+                        new_files = record(dirpath, entry, sigs)
+                        for subdir in entry[2]:
+                            futures[executor.submit(self._visit_dir, subdir)] = subdir
+                        yield from new_files
         else:
-            root = path
-            if not os.path.isabs(root):
-                root = os.path.join(cfg.get_root(), root)
+            pending = [root]
+            while pending:
+                dirpath = pending.pop()
+                entry, sigs = self._visit_dir(dirpath)
+                if entry is None:
+                    continue
+                pending.extend(entry[2])
+                yield from record(dirpath, entry, sigs)
 
-        new_curr = set()
-        # Recorrer filesystem y coleccionar rutas canónicas relativas a ROOT
-        for raiz, _, archivos in os.walk(root):
-            for archivo in archivos:
-                if archivo.lower().endswith(".png"):
-                    full_path = os.path.join(raiz, archivo)
-                    rel_canon = cfg.get_canonical_pathfile(full_path)
-                    new_curr.add(rel_canon)
+        # Directoris que ja no hi són (o fora de la nova arrel)
+        for dirpath, (_, files, _) in self._dirs.items():
+            if dirpath not in visited:
+                removed.update(files)
+
+        # Un mateix arxiu vist des de dos directoris diferents no és un canvi
+        moved = added & removed
+        added -= moved
+        removed -= moved
+
+        if self._full_diff:
+            # Estat carregat d'un manifest: no hi ha llistats previs per directori,
+            # cal comparar el conjunt sencer
+            current = set()
+            for _, files, _ in visited.values():
+                current.update(files)
+            added = current - self._prev
+            removed = self._prev - current
+
+        return added, removed, (visited, stats)
+
+    def _apply_walk(self, walk: tuple) -> None:
+        visited, stats = walk
+        self._dirs = visited
+        if self._track_modified:
+            self._stats = stats
+        self._full_diff = False
+
+    def _diff(self, added: set, removed: set) -> tuple:
+        # Només són canvis reals respecte de l'estat anterior
+        return added - self._prev, removed & self._prev
+
+    def _commit(self, added: set, removed: set) -> tuple:
+        added, removed = self._diff(added, removed)
+        self._prev |= added
+        self._prev -= removed
+        return added, removed
+
+    def _sorted_paths(self, ids) -> list:
+        return sorted(self._paths.path(pid) for pid in ids)
+
+    def reload_fs(self, path: str = None) -> None:
+        for _ in self.reload_fs_iter(path):
+            pass
+
+    def reload_fs_iter(self, path: str = None):
+        """
+        Variant generadora de reload_fs(): retorna els paths canònics dels
+        arxius nous a mesura que es descobreixen, sense esperar que acabi el
+        recorregut. Quan el generador s'exhaureix, files_added(),
+        files_removed() i files_modified() queden igual que amb reload_fs().
+        Si s'abandona a mitges, l'estat anterior no es modifica (en mode
+        watch, els canvis ja llegits d'inotify es reporten a la propera crida).
+        """
+        root = self._resolve_root(path)
+        self._found_modified = set()
+
+        # Primer es calculen els canvis i es lliuren; l'estat només s'actualitza
+        # quan el generador s'exhaureix
+        watching = self._watcher is not None and root == self._watch_root
+        if watching:
+            # Mode watch: els canvis vénen dels events d'inotify, sense recórrer res
+            added, removed, walk = self._drain_events()
+        else:
+            added, removed, walk = yield from self._iter_walk_diff(root)
+        added, removed = self._diff(added, removed)
+
+        delivered = False
+        try:
+            if watching:
+                yield from self._sorted_paths(added)
+            # Canvis detectats entre watch() i aquesta crida
+            yield from self._sorted_paths(self._pending_added - added - removed)
+            delivered = True
+        finally:
+            if watching and not delivered:
+                # Els events ja s'han llegit d'inotify: es tornen a tenir en compte a la propera crida
+                self._undelivered = (added, removed, set(self._found_modified), walk is not None)
+
+        if walk is not None:
+            self._apply_walk(walk)
+        self._commit(added, removed)
+        added |= self._pending_added
+        removed |= self._pending_removed
+        self._pending_added = set()
+        self._pending_removed = set()
 
         # detectar añadidos/eliminados y actualizar estado
-        self._added = sorted(list(new_curr - self._prev))
-        self._removed = sorted(list(self._prev - new_curr))
-        self._prev = new_curr
+        self._added = array('I', added - removed)
+        self._removed = array('I', removed - added)
+        self._modified = array('I', (self._found_modified & self._prev) - added)
+
+    def watch(self, path: str = None) -> None:
+        """
+        Activa el mode watch (Linux, inotify) sobre el directori indicat.
+
+        Fa una primera lectura completa (files_added() retorna tota la
+        col·lecció) i a partir d'aquí cada reload_fs() amb la mateixa arrel
+        només consumeix els events de creació, moviment i eliminació de .png
+        acumulats, sense recórrer el filesystem.
+        """
+        self.stop_watch()
+        root = self._resolve_root(path)
+        self.reload_fs(path)
+
+        self._watcher = Inotify()
+        self._watch_root = root
+        for dirpath in list(self._dirs):
+            try:
+                self._watcher.add_watch(dirpath)
+            except OSError:
+                pass
+
+        # El que hagi canviat mentre afegíem els watches es reporta al proper reload_fs()
+        self._pending_added, self._pending_removed = self._walk_diff(root)
+
+    def wait_changes(self, timeout: float = None) -> bool:
+        """Espera fins a 'timeout' segons que hi hagi events pendents (mode watch)."""
+        if self._watcher is None:
+            raise RuntimeError("ImageFiles no està en mode watch")
+        return self._watcher.wait(timeout)
+
+    def stop_watch(self) -> None:
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+            self._watch_root = None
+            self._undelivered = (set(), set(), set(), False)
+
+    def _watch_tree(self, dirpath: str) -> set:
+        # Vigila un directori nou (i subdirectoris) i retorna els .png que ja conté
+        files = set()
+        pending = [dirpath]
+        while pending:
+            current = pending.pop()
+            try:
+                self._watcher.add_watch(current)
+            except OSError:
+                continue
+            found, subdirs = self._scan_dir(current)
+            files.update(found)
+            pending.extend(subdirs)
+        return files
+
+    def _drain_events(self) -> tuple:
+        # (added, removed, walk) acumulats des de l'última crida, sense aplicar-los.
+        # walk no és None si s'han perdut events i s'ha hagut de recórrer tot
+        added, removed, modified, overflow = self._undelivered
+        self._undelivered = (set(), set(), set(), False)
+        self._found_modified |= modified
+
+        for dirpath, name, mask in self._watcher.read_events():
+            if mask & inotify.IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & (inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF):
+                if dirpath == self._watch_root:
+                    removed |= self._prev | added
+                    added.clear()
+                continue
+
+            full_path = os.path.join(dirpath, name)
+            if mask & inotify.IN_ISDIR:
+                if mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                    files = self._watch_tree(full_path)
+                    added |= files
+                    removed -= files
+                elif mask & (inotify.IN_DELETE | inotify.IN_MOVED_FROM):
+                    self._watcher.remove_watch(full_path)
+                    dirs = self._paths.dirs_with_prefix(cfg.get_canonical_pathfile(full_path) + "/")
+                    gone = {pid for pid in self._prev | added if self._paths.dir_of(pid) in dirs}
+                    removed |= gone
+                    added -= gone
+            elif name.lower().endswith(".png"):
+                canon = cfg.get_canonical_pathfile(full_path)
+                if mask & (inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO):
+                    pid = self._paths.add(canon)
+                    if pid in self._prev:
+                        # Reescrit al seu lloc (o substituït per un rename)
+                        self._found_modified.add(pid)
+                    else:
+                        added.add(pid)
+                    removed.discard(pid)
+                    if self._track_modified:
+                        sig = _file_signature(full_path)
+                        if sig is not None:
+                            self._stats[pid] = sig
+                elif mask & (inotify.IN_DELETE | inotify.IN_MOVED_FROM):
+                    # Un path que la taula no conté no és a la col·lecció: no cal afegir-l'hi
+                    pid = self._paths.find(canon)
+                    if pid is not None:
+                        removed.add(pid)
+                        added.discard(pid)
+
+        if overflow:
+            # S'han perdut events: cal una lectura completa del filesystem
+            walker = self._iter_walk_diff(self._watch_root)
+            while True:
+                try:
+                    next(walker)
+                except StopIteration as stop:
+                    walk_added, walk_removed, walk = stop.value
+                    break
+            for dirpath in walk[0]:
+                if dirpath not in self._watcher:
+                    try:
+                        self._watcher.add_watch(dirpath)
+                    except OSError:
+                        pass
+            # Els events primer i el recorregut després, respecte de l'estat actual
+            after = ((self._prev | added) - removed | walk_added) - walk_removed
+            return after - self._prev, self._prev - after, walk
+
+        return added, removed, None
+
+    def save_manifest(self, file: str = None) -> None:
+        """Guarda els arxius coneguts (path canònic, mida, st_mtime_ns i inode) en un manifest binari."""
+        file = file or cfg.FILES_MANIFEST
+        root = cfg.get_root()
+        stats = {}
+        entries = []
+        for pid in self._prev:
+            canon = self._paths.path(pid)
+            sig = _file_signature(os.path.join(root, canon))
+            if sig is not None:
+                stats[pid] = sig
+                entries.append((canon, sig))
+
+        tmp = file + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_MANIFEST_HEADER.pack(_MANIFEST_MAGIC, _MANIFEST_VERSION, len(entries)))
+            for canon, sig in sorted(entries):
+                data = canon.encode("utf-8")
+                f.write(_MANIFEST_ENTRY.pack(len(data), *sig))
+                f.write(data)
+        # Substitució atòmica: mai queda un manifest a mig escriure
+        os.replace(tmp, file)
+        self._stats = stats
+
+    def load_manifest(self, file: str = None) -> bool:
+        """
+        Carrega el manifest de l'últim escaneig com a estat anterior.
+
+        Així el primer reload_fs() del procés només reporta els canvis reals
+        des de l'última execució. Retorna False si el manifest no existeix o
+        no és vàlid (l'estat no es modifica).
+        """
+        file = file or cfg.FILES_MANIFEST
+        try:
+            with open(file, "rb") as f:
+                data = f.read()
+        except OSError:
+            return False
+
+        if len(data) < _MANIFEST_HEADER.size:
+            return False
+        magic, version, count = _MANIFEST_HEADER.unpack_from(data, 0)
+        if magic != _MANIFEST_MAGIC or version != _MANIFEST_VERSION:
+            return False
+
+        stats = {}
+        offset = _MANIFEST_HEADER.size
+        try:
+            for _ in range(count):
+                length, size, mtime, inode = _MANIFEST_ENTRY.unpack_from(data, offset)
+                offset += _MANIFEST_ENTRY.size
+                if offset + length > len(data):
+                    return False
+                stats[self._paths.add(data[offset:offset + length].decode("utf-8"))] = (size, mtime, inode)
+                offset += length
+        except (struct.error, UnicodeDecodeError):
+            return False
+
+        self._prev = set(stats)
+        self._stats = stats
+        self._dirs = {}
+        self._full_diff = True
+        self._added = array('I')
+        self._removed = array('I')
+        self._modified = array('I')
+        return True
 
     def files_added(self) -> list:
-        return list(self._added)
+        return self._sorted_paths(self._added)
 
     def files_removed(self) -> list:
-        return list(self._removed)
+        return self._sorted_paths(self._removed)
+
+    def files_modified(self) -> list:
+        """
+        Paths dels arxius que ja hi eren però han canviat (mida, mtime o, amb
+        use_inode, inode) des de l'última crida a reload_fs(). Requereix
+        track_modified=True o el mode watch.
+        """
+        return self._sorted_paths(self._modified)
 
     def __str__(self):
-        return f'ImageFiles: Added {self._added}, Removed: {self._removed}'
+        return f'ImageFiles: Added {self.files_added()}, Removed: {self.files_removed()}'
     
     def __len__(self):
         return len(self._prev)
\ No newline at end of file
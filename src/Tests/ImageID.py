@@ -21,61 +21,348 @@ Mètodes a implementar:
         Retorna el UUID associat a l'arxiu, si ja ha estat generat.
         Si no existeix, retorna None.
 
+    - generate_uuids(files: list, workers: int = 1) -> list
+        Com generate_uuid() per a una llista d'arxius (mateix ordre).
+        Amb workers > 1 els lots grans es calculen en un pool de processos.
+
     - remove_uuid(uuid: str) -> None
         Elimina el UUID del registre d'identificadors actius.
         Després d'eliminar-lo, aquest UUID es podrà tornar a utilitzar.
 
+    - is_retired(uuid: str) -> bool
+        True si el UUID s'ha eliminat amb remove_uuid() (i no s'ha tornat a generar).
+
 Notes:
     - Els UUID han de seguir el format estàndard (128 bits)
     - Podeu utilitzar la funció cfg.get_uuid() com a base
     - Els UUID s'emmagatzemen com a strings
     - Un UUID només es pot generar una vegada (fins que s'elimini)
+    - La canonicalització es memoritza per directori: cada directori pare es
+      resol (realpath) una sola vegada i, si el path ja és canònic (p.ex. el de
+      ImageFiles.files_added()), es retorna tal qual sense cap crida al sistema
+    - La cache reflecteix els directoris i enllaços simbòlics del moment en què
+      es resolen per primer cop
+    - Amb ImageID(compact=True) els UUID es guarden com a claus de 16 bytes
+      ordenades en un sol bytearray (cerca per bisecció) i només es
+      converteixen a string en retornar-los. No hi ha índex path -> UUID: el
+      UUIDv5 es recalcula del path canònic i es comprova a la taula
+    - Amb ImageID(registry=UuidRegistry()) cada generació i eliminació
+      s'afegeix al registre persistent, que es reprodueix en crear l'ImageID
+      (el catàleg es recupera sense recórrer el filesystem)
 """
 import os
+import uuid
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha1
 import cfg
+import PathTable
+from UuidRegistry import UuidRegistry, OP_GENERATE
+
+# UUIDv5 (el mateix que cfg.get_uuid) calculat directament sobre l'enter de 128 bits
+_UUID5_PREFIX = uuid.NAMESPACE_URL.bytes
+_UUID5_CLEAR = ~((0xf000 << 64) | (0xc000 << 48))  # bits de versió i variant
+_UUID5_SET = (5 << 76) | (0x8000 << 48)             # versió 5, variant RFC 4122
+
+
+def _uuid5_ints(names: list) -> list:
+    # Equivalent a [cfg.get_uuid(name).int for name in names], sense crear objectes UUID
+    from_bytes = int.from_bytes
+    return [(from_bytes(sha1(_UUID5_PREFIX + name.encode("utf-8")).digest()[:16], "big")
+             & _UUID5_CLEAR) | _UUID5_SET for name in names]
+
+
+def _int_to_str(key: int) -> str:
+    h = "%032x" % key
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+_MERGE_AT = 1024  # Insercions que s'acumulen abans de fusionar-les a la taula ordenada
+
+
+class _PackedUuids:
+    """
+    uuid (enter de 128 bits) -> id del path, amb la interfície de dict que fa
+    servir ImageID. Les claus es guarden com a 16 bytes big-endian, ordenades,
+    en un sol bytearray (amb un array('I') paral·lel d'ids) i es busquen per
+    bisecció. Les insercions recents esperen en un dict petit i es fusionen
+    totes de cop.
+    """
+
+    __slots__ = ('_keys', '_path_ids', '_pending')
 
-class ImageID:
     def __init__(self):
-        self._file2uuid = {}  # rel_path_canon -> uuid_str
-        self._uuid2file = {}  # uuid_str -> rel_path_canon
+        self._keys = bytearray()     # Claus de 16 bytes, ordenades
+        self._path_ids = array('I')  # Id del path de cada clau
+        self._pending = {}           # Insercions encara no fusionades: uuid -> id del path
 
-    def _rel_to_canonical(self, file: str) -> str:
+    def _find(self, packed: bytes) -> int:
+        # Posició de la primera clau >= packed
+        keys = self._keys
+        lo, hi = 0, len(self._path_ids)
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if keys[mid << 4:(mid << 4) + 16] < packed:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _index(self, key: int) -> int:
+        # Posició de la clau a la taula ordenada, o -1
+        packed = key.to_bytes(16, "big")
+        i = self._find(packed)
+        if i < len(self._path_ids) and self._keys[i << 4:(i << 4) + 16] == packed:
+            return i
+        return -1
+
+    def _merge(self) -> None:
+        keys, path_ids = bytearray(), array('I')
+        start = 0
+        for key, path_id in sorted(self._pending.items()):
+            packed = key.to_bytes(16, "big")
+            i = self._find(packed)
+            keys += self._keys[start << 4:i << 4]
+            keys += packed
+            path_ids += self._path_ids[start:i]
+            path_ids.append(path_id)
+            start = i
+        keys += self._keys[start << 4:]
+        path_ids += self._path_ids[start:]
+        self._keys, self._path_ids, self._pending = keys, path_ids, {}
+
+    def get(self, key: int, default=None):
+        path_id = self._pending.get(key)
+        if path_id is not None:
+            return path_id
+        i = self._index(key)
+        return default if i < 0 else self._path_ids[i]
+
+    def __setitem__(self, key: int, path_id: int) -> None:
+        i = -1 if key in self._pending else self._index(key)
+        if i >= 0:
+            self._path_ids[i] = path_id
+            return
+        self._pending[key] = path_id
+        if len(self._pending) >= _MERGE_AT:
+            self._merge()
+
+    def pop(self, key: int, default=None):
+        path_id = self._pending.pop(key, None)
+        if path_id is not None:
+            return path_id
+        i = self._index(key)
+        if i < 0:
+            return default
+        path_id = self._path_ids[i]
+        del self._keys[i << 4:(i << 4) + 16]
+        del self._path_ids[i]
+        return path_id
+
+    def items(self):
+        yield from self._pending.items()
+        keys = self._keys
+        for i, path_id in enumerate(self._path_ids):
+            yield int.from_bytes(keys[i << 4:(i << 4) + 16], "big"), path_id
+
+    def __len__(self):
+        return len(self._pending) + len(self._path_ids)
+
+class ImageID:
+    def __init__(self, path_table: PathTable.PathTable = None, compact: bool = False,
+                 registry: UuidRegistry = None):
+        self._paths = path_table or PathTable.shared()
+        self._compact = compact
+        # uuid (str, o int si compact) -> id del path canònic (PathTable), i l'invers.
+        # En mode compacte no hi ha índex invers: el uuid es recalcula del path
+        self._uuid2file = _PackedUuids() if compact else {}
+        self._file2uuid = None if compact else {}
+        self._retired = set()  # uuid eliminats amb remove_uuid()
+        self._dir_cache = {}  # directori (tal com arriba) -> (prefix canònic, enllaços)
+        self._registry = registry  # Registre persistent opcional
+        if registry is not None:
+            self._replay()
+
+    def _replay(self) -> None:
+        for op, uuid_int, path in self._registry.replay():
+            key = uuid_int if self._compact else _int_to_str(uuid_int)
+            if op == OP_GENERATE:
+                self._bind(self._paths.add(path), key)
+                self._retired.discard(key)
+            else:
+                self._unbind(key)
+                self._retired.add(key)
+        self._compact_registry()
+
+    def _compact_registry(self) -> None:
+        if not self._registry.needs_compaction(len(self), len(self._retired)):
+            return
+        live = ((self._to_int(key), self._paths.path(path_id)) for key, path_id in self._uuid2file.items())
+        self._registry.compact(live, (self._to_int(key) for key in self._retired))
+
+    def _key_of(self, path_id: int):
+        # uuid (representació interna) assignat al path, o None
+        if not self._compact:
+            return self._file2uuid.get(path_id)
+        key = _uuid5_ints([self._paths.path(path_id)])[0]
+        return key if self._uuid2file.get(key) == path_id else None
+
+    def _bind(self, path_id: int, key) -> None:
+        if not self._compact:
+            self._file2uuid[path_id] = key
+        self._uuid2file[key] = path_id
+
+    def _unbind(self, key) -> int:
+        path_id = self._uuid2file.pop(key, None)
+        if path_id is not None and not self._compact:
+            self._file2uuid.pop(path_id, None)
+        return path_id
+
+    def _log(self, key, path: str = None) -> None:
+        # Afegeix l'event al registre (path None: eliminació)
+        if path is None:
+            self._registry.append_remove(self._to_int(key))
+        else:
+            self._registry.append_generate(self._to_int(key), path)
+        self._compact_registry()
+
+    def _resolve(self, file: str) -> str:
         abs_path = file if os.path.isabs(file) else os.path.join(cfg.get_root(), file)
         abs_path = os.path.realpath(abs_path)
         return cfg.get_canonical_pathfile(abs_path)
+
+    def _canonical_dir(self, directory: str) -> tuple:
+        cached = self._dir_cache.get(directory)
+        if cached is None:
+            abs_dir = os.path.realpath(os.path.join(cfg.get_root(), directory))
+            canon = cfg.get_canonical_pathfile(abs_dir)
+            prefix = "" if canon == "." else canon + "/"
+            # Els arxius que són enllaços simbòlics s'han de resoldre un a un
+            try:
+                with os.scandir(abs_dir) as entries:
+                    links = frozenset(entry.name for entry in entries if entry.is_symlink())
+            except OSError:
+                links = frozenset()
+            cached = (prefix, links)
+            self._dir_cache[directory] = cached
+        return cached
+
+    def _to_key(self, uuid_str: str):
+        # Representació interna d'un UUID; None si el string no és un UUID vàlid
+        if not self._compact:
+            return uuid_str
+        try:
+            return uuid.UUID(uuid_str).int
+        except (ValueError, TypeError, AttributeError):
+            return None
+
+    def _to_str(self, key) -> str:
+        return _int_to_str(key) if self._compact else key
+
+    def _to_int(self, key) -> int:
+        return key if self._compact else uuid.UUID(key).int
+
+    def _rel_to_canonical(self, file: str) -> str:
+        directory, name = os.path.split(file)
+        if name in ("", ".", ".."):
+            return self._resolve(file)
+        prefix, links = self._canonical_dir(directory)
+        if name in links:
+            return self._resolve(file)
+        # os.path.split() treu les "/" repetides del directori: només es pot
+        # reaprofitar file si ja és exactament el path canònic
+        canon = prefix + name
+        return file if canon == file else canon
     
     def generate_uuid(self, file: str) -> str:
         canon = self._rel_to_canonical(file) 
+        path_id = self._paths.add(canon)
 
         # Ja existeix per aquest fitxer
-        if canon in self._file2uuid:
-            return self._file2uuid[canon]
+        key = self._key_of(path_id)
+        if key is not None:
+            return self._to_str(key)
 
         # UUID determinista basat en el path canònic
         uuid_obj = cfg.get_uuid(canon)
         uuid_str = str(uuid_obj)
+        key = uuid_obj.int if self._compact else uuid_str
 
         # Col·lisió: mateix UUID per fitxer diferent
-        other = self._uuid2file.get(uuid_str)
-        if other is not None and other != canon:
-            print(f"ERROR: Col·lisió UUID: {uuid_str} ja assignat a {other}")
+        other = self._uuid2file.get(key)
+        if other is not None and other != path_id:
+            print(f"ERROR: Col·lisió UUID: {uuid_str} ja assignat a {self._paths.path(other)}")
             return None
 
-        self._file2uuid[canon] = uuid_str
-        self._uuid2file[uuid_str] = canon
+        self._bind(path_id, key)
+        self._retired.discard(key)
+        if self._registry is not None:
+            self._log(key, canon)
         return uuid_str
 
+    def generate_uuids(self, files: list, workers: int = 1, chunk_size: int = 8192) -> list:
+        """
+        Versió per lots de generate_uuid(): retorna la llista d'UUID en el
+        mateix ordre que files (None per a les col·lisions).
+
+        Els UUID es calculen directament amb sha1 i amb workers > 1 els lots de
+        més de chunk_size arxius es reparteixen entre un pool de processos.
+        """
+        path_ids = [self._paths.add(self._rel_to_canonical(file)) for file in files]
+
+        # Arxius que encara no tenen UUID (cada un només un cop)
+        known = {}
+        for path_id in dict.fromkeys(path_ids):
+            key = self._key_of(path_id)
+            if key is not None:
+                known[path_id] = key
+        pending = [path_id for path_id in dict.fromkeys(path_ids) if path_id not in known]
+        names = [self._paths.path(path_id) for path_id in pending]
+        if workers > 1 and len(names) > chunk_size:
+            blocks = [names[i:i + chunk_size] for i in range(0, len(names), chunk_size)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                keys = [key for block in executor.map(_uuid5_ints, blocks) for key in block]
+        else:
+            keys = _uuid5_ints(names)
+
+        for path_id, name, key in zip(pending, names, keys):
+            if not self._compact:
+                key = _int_to_str(key)
+            other = self._uuid2file.get(key)
+            if other is not None and other != path_id:
+                print(f"ERROR: Col·lisió UUID: {self._to_str(key)} ja assignat a {self._paths.path(other)}")
+                continue
+            self._bind(path_id, key)
+            known[path_id] = key
+            self._retired.discard(key)
+            if self._registry is not None:
+                self._log(key, name)
+
+        if self._registry is not None:
+            self._registry.flush()
+        # Les col·lisions no tenen UUID
+        return [self._to_str(known[path_id]) if path_id in known else None for path_id in path_ids]
+
     def get_uuid(self, file: str) -> str:
-        canon = self._rel_to_canonical(file)
-        return self._file2uuid.get(canon)
+        path_id = self._paths.find(self._rel_to_canonical(file))
+        if path_id is None:
+            return None
+        key = self._key_of(path_id)
+        return None if key is None else self._to_str(key)
 
     def remove_uuid(self, uuid: str) -> None:
-        canon = self._uuid2file.pop(uuid, None)
-        if canon is not None:
-            self._file2uuid.pop(canon, None)
+        key = self._to_key(uuid)
+        if self._unbind(key) is not None:
+            self._retired.add(key)
+            if self._registry is not None:
+                self._log(key)
+
+    def is_retired(self, uuid: str) -> bool:
+        return self._to_key(uuid) in self._retired
 
     def __str__(self):
-        return f'ImageID: {self._file2uuid}'
+        files = {self._paths.path(path_id): self._to_str(key) for key, path_id in self._uuid2file.items()}
+        return f'ImageID: {files}'
     
     def __len__(self):
-        return len(self._file2uuid)
\ No newline at end of file
+        return len(self._uuid2file)
\ No newline at end of file
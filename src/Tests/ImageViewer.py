@@ -60,32 +60,25 @@ class ImageViewer:
             return
          
         try:
-            w, h    = self._image.get_dimensions(uuid)
-            prompt  = self._image.get_prompt(uuid)
-            model   = self._image.get_model(uuid)
-            seed    = self._image.get_seed(uuid)
-            cfg_s   = self._image.get_cfg_scale(uuid)
-            steps   = self._image.get_steps(uuid)
-            samp    = self._image.get_sampler(uuid)
-            gen     = self._image.get_generated(uuid)
-            date    = self._image.get_created_date(uuid)
-            path    = self._image.get_file(uuid)
+            # Tots els camps en una sola consulta
+            rec = self._image.get_record(uuid)
         except KeyError:
             print(f"[ImageViewer] UUID inexistent : {uuid}")
             return
 
+        w, h = rec.dimensions
         msg = (
             f"- Dimensions: {w} x {h}\n"
-            f"- Prompt: {prompt[:50]}...\n"
-            f"- Model: {model}\n"
-            f"- Seed: {seed}\n"
-            f"- CFG Scale: {cfg_s}\n"
-            f"- Steps: {steps}\n"
-            f"- Sampler: {samp}\n"
-            f"- Generated: {gen}\n"
-            f"- Created Date: {date}\n"
+            f"- Prompt: {rec.prompt[:50]}...\n"
+            f"- Model: {rec.model}\n"
+            f"- Seed: {rec.seed}\n"
+            f"- CFG Scale: {rec.cfg_scale}\n"
+            f"- Steps: {rec.steps}\n"
+            f"- Sampler: {rec.sampler}\n"
+            f"- Generated: {rec.generated}\n"
+            f"- Created Date: {rec.created_date}\n"
             f"- UUID: {uuid}\n"
-            f"- Path de l'arxiu: {path}"
+            f"- Path de l'arxiu: {rec.file}"
         )
         print(msg)
 
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Ingestion.py : Ingesta asíncrona (asyncio) de la col·lecció d'imatges.
+
+Encadena ImageFiles -> ImageID -> ImageData en un pipeline amb concurrència
+limitada, pensat per a serveis que ja funcionen sobre asyncio.
+
+Funcionalitat:
+    - Recórrer el filesystem amb ImageFiles.reload_fs_iter() sense bloquejar el loop
+    - Generar l'UUID de cada arxiu afegit amb ImageID
+    - Llegir les capçaleres PNG en paral·lel (com a màxim 'concurrency' alhora)
+    - Incorporar els resultats a ImageData per blocs de 'batch_size'
+
+Funcions:
+    - ingest(image_files, image_id, image_data, path=None, concurrency=16,
+             batch_size=256, executor=None) -> list   (coroutine)
+        Retorna la llista d'UUID incorporats a ImageData.
+
+Notes:
+    - La cua entre productor i lectors té mida limitada (backpressure): no es
+      generen més UUID dels que els lectors poden anar consumint
+    - Les lectures i la canonicalització dels paths es fan en un executor;
+      així la latència d'un volum de xarxa se solapa en lloc de sumar-se
+      imatge a imatge
+    - Si una lectura falla o la coroutine es cancel·la, la resta de tasques
+      (també el recorregut del filesystem) s'aturen abans de propagar l'error
+    - Les primeres imatges s'incorporen mentre el recorregut encara continua
+
+Exemple:
+    uuids = asyncio.run(ingest(ImageFiles(), ImageID(), ImageData()))
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from ImageData import ImageData
+from ImageFiles import ImageFiles
+from ImageID import ImageID
+
+
+async def ingest(image_files: ImageFiles, image_id: ImageID, image_data: ImageData,
+                 path: str = None, concurrency: int = 16, batch_size: int = 256,
+                 executor=None) -> list:
+    if concurrency < 1:
+        raise ValueError("concurrency ha de ser >= 1")
+    if batch_size < 1:
+        raise ValueError("batch_size ha de ser >= 1")
+
+    loop = asyncio.get_running_loop()
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    paths = asyncio.Queue(maxsize=2 * concurrency)
+    queue = asyncio.Queue(maxsize=2 * concurrency)
+    batch = []      # [(uuid, metadata, dimensions)] pendents d'incorporar
+    ingested = []
+
+    def commit() -> None:
+        # S'executa al thread del loop: ImageData només es modifica des d'aquí
+        for uuid, metadata, dimensions in batch:
+            image_data.store_metadata(uuid, metadata, dimensions)
+            ingested.append(uuid)
+        batch.clear()
+
+    stop = threading.Event()  # El pipeline s'ha aturat: el recorregut ha de plegar
+
+    def put(item) -> bool:
+        # Thread del recorregut: espera amb límit per no quedar bloquejat si
+        # ja no queda ningú que buidi la cua
+        future = asyncio.run_coroutine_threadsafe(paths.put(item), loop)
+        while True:
+            try:
+                future.result(timeout=0.1)
+                return True
+            except FutureTimeoutError:
+                if stop.is_set():
+                    future.cancel()
+                    return False
+
+    def walk() -> None:
+        # Thread propi: cada arxiu nou passa al pipeline tan aviat com es
+        # descobreix, sense esperar el final del recorregut
+        files = image_files.reload_fs_iter(path)
+        try:
+            for file in files:
+                if stop.is_set() or not put(file):
+                    return
+        finally:
+            files.close()
+            if not stop.is_set():
+                put(None)
+
+    async def producer() -> None:
+        while True:
+            file = await paths.get()
+            if file is None:
+                break
+            # La canonicalització (realpath) també pot tocar el disc
+            uuid = await loop.run_in_executor(executor, image_id.generate_uuid, file)
+            if uuid is None:
+                continue
+            try:
+                image_data.add_image(uuid, file)
+            except KeyError:
+                pass  # Ja registrada: només en rellegim les metadades
+            await queue.put(uuid)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def reader() -> None:
+        while True:
+            uuid = await queue.get()
+            if uuid is None:
+                break
+            metadata, dimensions = await loop.run_in_executor(executor, image_data.read_metadata, uuid)
+            batch.append((uuid, metadata, dimensions))
+            if len(batch) >= batch_size:
+                commit()
+
+    # El recorregut té el seu propi thread: si ocupés un lloc de l'executor de
+    # lectures, amb la cua plena es podrien bloquejar mútuament
+    walker = ThreadPoolExecutor(max_workers=1)
+    tasks = [asyncio.wrap_future(walker.submit(walk)), asyncio.ensure_future(producer())]
+    tasks += [asyncio.ensure_future(reader()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*tasks)
+        commit()
+    except BaseException:
+        # Si una tasca falla (o ens cancel·len), les altres s'aturen abans de
+        # retornar: ningú no ha de continuar modificant image_data
+        stop.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        stop.set()
+        # El recorregut plega en menys de 0.1 s; s'espera fora del thread del loop
+        await loop.run_in_executor(None, walker.shutdown)
+        if own_executor:
+            # Les lectures en curs s'esperen fora del thread del loop
+            await loop.run_in_executor(None, executor.shutdown)
+
+    return ingested
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Inotify.py : Binding mínim (ctypes) de l'API inotify de Linux.
+
+Permet rebre events del kernel quan es creen, mouen o eliminen arxius dins
+els directoris vigilats, sense haver de recórrer el filesystem.
+
+Mètodes:
+    - add_watch(path: str) -> int
+        Comença a vigilar el directori i retorna el watch descriptor.
+
+    - remove_watch(path: str) -> None
+        Deixa de vigilar el directori (i els seus subdirectoris vigilats).
+
+    - wait(timeout: float) -> bool
+        Espera fins a 'timeout' segons que hi hagi events pendents.
+
+    - read_events() -> list
+        Retorna tots els events pendents com a tuples (dirpath, name, mask).
+
+    - close() -> None
+        Tanca el descriptor inotify.
+
+Notes:
+    - Només disponible a Linux: en altres plataformes el constructor llança OSError
+    - No bloqueja: read_events() retorna [] si no hi ha events
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+_BUFFER_SIZE = 64 * 1024
+
+
+class Inotify:
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c")
+        try:
+            self._libc = ctypes.CDLL(libc_name, use_errno=True)
+            self._libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError("inotify només està disponible a Linux")
+
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1: {os.strerror(errno)}")
+
+        self._wd2path = {}
+        self._path2wd = {}
+
+    def add_watch(self, path: str) -> int:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_add_watch: {os.strerror(errno)}", path)
+        self._wd2path[wd] = path
+        self._path2wd[path] = wd
+        return wd
+
+    def remove_watch(self, path: str) -> None:
+        prefix = path.rstrip(os.sep) + os.sep
+        for watched in [p for p in self._path2wd if p == path or p.startswith(prefix)]:
+            wd = self._path2wd.pop(watched)
+            self._wd2path.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def wait(self, timeout: float = None) -> bool:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        return bool(readable)
+
+    def read_events(self) -> list:
+        events = []
+        while True:
+            try:
+                buf = os.read(self._fd, _BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            if not buf:
+                break
+
+            offset = 0
+            while offset + _EVENT.size <= len(buf):
+                wd, mask, _, length = _EVENT.unpack_from(buf, offset)
+                offset += _EVENT.size
+                name = os.fsdecode(buf[offset:offset + length].split(b"\0", 1)[0])
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    events.append((None, "", mask))
+                    continue
+                dirpath = self._wd2path.get(wd)
+                if mask & IN_IGNORED:
+                    # El kernel ha eliminat el watch (directori esborrat)
+                    if dirpath is not None:
+                        self._wd2path.pop(wd, None)
+                        if self._path2wd.get(dirpath) == wd:
+                            del self._path2wd[dirpath]
+                    continue
+                if dirpath is not None:
+                    events.append((dirpath, name, mask))
+        return events
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._path2wd
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+            self._wd2path.clear()
+            self._path2wd.clear()
+
+    def __str__(self):
+        return f'Inotify: {len(self._wd2path)} directoris vigilats'
+
+    def __len__(self):
+        return len(self._wd2path)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+MetadataCache.py : Cache persistent de les metadades llegides dels PNG.
+
+Aquesta classe guarda en un arxiu SQLite (per defecte cfg.METADATA_CACHE, al
+costat de ROOT_DIR) les metadades i dimensions ja llegides de cada imatge.
+
+Funcionalitat:
+    - Evitar tornar a llegir les capçaleres PNG en reiniciar el procés
+    - Invalidar automàticament les entrades d'arxius que han canviat
+
+Mètodes:
+    - get(file: str, st: os.stat_result) -> tuple
+        Retorna (metadata, (width, height)) si l'arxiu és a la cache i no ha
+        canviat (mateixa mida i st_mtime_ns). Si no, retorna None.
+
+    - put(file: str, st: os.stat_result, metadata: dict, dimensions: tuple) -> None
+        Guarda (o substitueix) l'entrada de l'arxiu.
+
+    - flush() -> None
+        Escriu a disc les entrades pendents.
+
+Notes:
+    - La clau és el path canònic (relatiu a ROOT_DIR), la mida i st_mtime_ns
+    - Un reinici en calent costa un stat per arxiu en lloc de llegir el PNG
+    - Es pot compartir entre threads (l'accés a SQLite està protegit per un lock)
+"""
+import atexit
+import base64
+import json
+import sqlite3
+import threading
+import cfg
+
+
+class MetadataCache:
+
+    _COMMIT_EVERY = 1000
+
+    def __init__(self, path: str = None):
+        self._path = path or cfg.METADATA_CACHE
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self._path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " width INTEGER,"
+            " height INTEGER,"
+            " fields TEXT NOT NULL,"
+            " compressed TEXT NOT NULL)"
+        )
+        self._pending = 0
+        atexit.register(self.close)
+
+    def get(self, file: str, st) -> tuple:
+        with self._lock:
+            if self._conn is None:
+                return None
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, width, height, fields, compressed"
+                " FROM metadata WHERE path = ?",
+                (cfg.get_canonical_pathfile(file),),
+            ).fetchone()
+        if row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns:
+            return None
+        metadata = cfg.PngMetadata(json.loads(row[4]))
+        # Els textos comprimits (zTXt/iTXt) es guarden sense descomprimir
+        for keyword, (data, encoding) in json.loads(row[5]).items():
+            metadata.add_compressed(keyword, base64.b64decode(data), encoding)
+        return metadata, (row[2], row[3])
+
+    def put(self, file: str, st, metadata: dict, dimensions: tuple) -> None:
+        width, height = dimensions
+        compressed = {}
+        if isinstance(metadata, cfg.PngMetadata):
+            for keyword, (data, encoding) in metadata.compressed_items():
+                compressed[keyword] = (base64.b64encode(data).decode("ascii"), encoding)
+        row = (cfg.get_canonical_pathfile(file), st.st_size, st.st_mtime_ns,
+               width, height, json.dumps(metadata), json.dumps(compressed))
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.execute("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+            self._pending += 1
+            if self._pending >= self._COMMIT_EVERY:
+                self._commit()
+
+    def _commit(self) -> None:
+        if self._conn is not None and self._pending:
+            self._conn.commit()
+            self._pending = 0
+
+    def flush(self) -> None:
+        with self._lock:
+            self._commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._commit()
+                self._conn.close()
+                self._conn = None
+
+    def __str__(self):
+        return f'MetadataCache: {self._path}'
+
+    def __len__(self):
+        with self._lock:
+            if self._conn is None:
+                return 0
+            return self._conn.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
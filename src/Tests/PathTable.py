@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+PathTable.py : Taula compacta i compartida de paths d'arxiu.
+
+Cada path es guarda un sol cop, partit en directori i nom d'arxiu, i
+s'identifica amb un enter (id). ImageFiles, ImageID i ImageData guarden
+aquests ids en lloc de les seves pròpies còpies dels paths complets.
+
+Funcionalitat:
+    - Cada directori es guarda una sola vegada
+    - Els noms d'arxiu de cada directori es guarden en utf-8, un darrere
+      l'altre en un sol bytearray, amb un array('I') d'offsets: cap objecte
+      str per arxiu
+    - Conversió path <-> id en temps constant
+
+Mètodes:
+    - add(path: str) -> int
+        Retorna l'id del path, afegint-lo a la taula si no hi era.
+
+    - add_in_dir(directory: str, name: str) -> int
+        Com add(directory + name), sense construir el path complet.
+        directory ha d'acabar en "/" (o ser "").
+
+    - find(path: str) -> int
+        Retorna l'id del path, o None si no és a la taula.
+
+    - path(path_id: int) -> str
+        Reconstrueix el path a partir del seu id.
+
+Notes:
+    - La taula només creix: els ids són estables i no es reutilitzen
+    - Es pot afegir des de diversos threads alhora
+    - shared() retorna la taula que comparteixen per defecte totes les classes;
+      dura tant com el procés i conserva tots els paths que s'hi han afegit,
+      també els d'arxius ja eliminats. Un servei de llarga durada (p.ex. amb
+      ImageFiles.watch()) hauria de crear una PathTable per catàleg i passar-la
+      a ImageFiles, ImageID i ImageData (path_table=...): la memòria
+      s'allibera amb el catàleg
+    - El path es parteix per l'últim "/"; path(add(p)) == p per a qualsevol string
+      (els surrogates de os.fsdecode es conserven amb "surrogatepass")
+    - L'índex (directori, nom) -> id és una sola taula d'adreçament obert que
+      guarda els objectes int dels ids: ImageFiles, ImageID i ImageData
+      comparteixen el mateix objecte per path. find() no agafa el lock
+"""
+import sys
+import threading
+from array import array
+
+_ENCODING = "utf-8"
+_ERRORS = "surrogatepass"  # Noms d'arxiu amb bytes no vàlids (os.fsdecode)
+
+
+class PathTable:
+
+    __slots__ = ('_dirs', '_dir_ids', '_heaps', '_offsets', '_path_dir', '_path_pos', '_slots', '_lock')
+
+    def __init__(self):
+        self._dirs = []          # dir_id -> directori (acabat en "/" o "")
+        self._dir_ids = {}       # directori -> dir_id
+        self._heaps = []         # dir_id -> bytearray amb els noms del directori, un darrere l'altre
+        self._offsets = []       # dir_id -> array('I'): el nom i ocupa heap[offsets[i]:offsets[i + 1]]
+        self._path_dir = array('I')  # path_id -> dir_id
+        self._path_pos = array('I')  # path_id -> posició del nom dins del seu directori
+        self._slots = [None] * 8     # Índex (directori, nom) -> path_id, adreçament obert
+        self._lock = threading.Lock()  # Només per afegir (ImageFiles recorre amb threads)
+
+    @staticmethod
+    def _split(path: str) -> tuple:
+        cut = path.rfind("/") + 1
+        return path[:cut], path[cut:]
+
+    def _name_bytes(self, path_id: int) -> bytearray:
+        offsets = self._offsets[self._path_dir[path_id]]
+        pos = self._path_pos[path_id]
+        return self._heaps[self._path_dir[path_id]][offsets[pos]:offsets[pos + 1]]
+
+    def _lookup(self, dir_id: int, name: str):
+        # Retorna (path_id o None, slot lliure on aniria, taula consultada)
+        slots = self._slots
+        mask = len(slots) - 1
+        i = (hash(name) + dir_id * 1000003) & mask
+        path_dir = self._path_dir
+        encoded = None
+        while True:
+            path_id = slots[i]
+            if path_id is None:
+                return None, i, slots
+            if path_dir[path_id] == dir_id:
+                if encoded is None:
+                    encoded = name.encode(_ENCODING, _ERRORS)
+                    heap, offsets, pos = self._heaps[dir_id], self._offsets[dir_id], self._path_pos
+                start, end = offsets[pos[path_id]], offsets[pos[path_id] + 1]
+                if end - start == len(encoded) and heap[start:end] == encoded:
+                    return path_id, i, slots
+            i = (i + 1) & mask
+
+    def _grow(self) -> None:
+        # La taula nova es publica sencera: find() sense lock no veu mai una taula a mig fer
+        slots = [None] * (len(self._slots) * 2)
+        mask = len(slots) - 1
+        for path_id in self._slots:
+            if path_id is None:
+                continue
+            i = (hash(self.name(path_id)) + self._path_dir[path_id] * 1000003) & mask
+            while slots[i] is not None:
+                i = (i + 1) & mask
+            slots[i] = path_id
+        self._slots = slots
+
+    def _dir_id(self, directory: str) -> int:
+        dir_id = self._dir_ids.get(directory)
+        if dir_id is None:
+            dir_id = len(self._dirs)
+            directory = sys.intern(directory)
+            self._dirs.append(directory)
+            self._heaps.append(bytearray())
+            self._offsets.append(array('I', (0,)))
+            self._dir_ids[directory] = dir_id
+        return dir_id
+
+    def add_in_dir(self, directory: str, name: str) -> int:
+        dir_id = self._dir_ids.get(directory)
+        if dir_id is not None:
+            path_id = self._lookup(dir_id, name)[0]
+            if path_id is not None:
+                return path_id
+
+        with self._lock:
+            dir_id = self._dir_id(directory)
+            path_id, i, slots = self._lookup(dir_id, name)
+            if path_id is None:
+                path_id = len(self._path_dir)
+                heap, offsets = self._heaps[dir_id], self._offsets[dir_id]
+                heap += name.encode(_ENCODING, _ERRORS)
+                offsets.append(len(heap))
+                self._path_dir.append(dir_id)
+                self._path_pos.append(len(offsets) - 2)
+                # L'id es publica a l'índex quan el nom ja és al heap
+                slots[i] = path_id
+                if 2 * len(self._path_dir) > len(slots):
+                    self._grow()
+        return path_id
+
+    def add(self, path: str) -> int:
+        return self.add_in_dir(*self._split(path))
+
+    def find(self, path: str) -> int:
+        directory, name = self._split(path)
+        dir_id = self._dir_ids.get(directory)
+        if dir_id is None:
+            return None
+        return self._lookup(dir_id, name)[0]
+
+    def path(self, path_id: int) -> str:
+        return self._dirs[self._path_dir[path_id]] + self.name(path_id)
+
+    def name(self, path_id: int) -> str:
+        return self._name_bytes(path_id).decode(_ENCODING, _ERRORS)
+
+    def dir_of(self, path_id: int) -> int:
+        return self._path_dir[path_id]
+
+    def dirs_with_prefix(self, prefix: str) -> set:
+        """Ids dels directoris que comencen per prefix (p.ex. un directori i tots els seus fills)."""
+        return {dir_id for dir_id, directory in enumerate(self._dirs) if directory.startswith(prefix)}
+
+    def __str__(self):
+        return f'PathTable: {len(self._path_dir)} paths, {len(self._dirs)} directoris'
+
+    def __len__(self):
+        return len(self._path_dir)
+
+
+_shared = None
+
+
+def shared() -> PathTable:
+    """Taula compartida per defecte per ImageFiles, ImageID i ImageData."""
+    global _shared
+    if _shared is None:
+        _shared = PathTable()
+    return _shared
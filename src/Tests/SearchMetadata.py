@@ -71,12 +71,7 @@ class SearchMetadata:
         self._image_data = image_data or ImageData()
 
     def _search_field(self, field: str, sub: str) -> list:
-        results = []
-        for uuid, metadata in self._image_data.get_Image_Data().items():
-            value = metadata[field] 
-            if value != None and value.find(sub) >= 0:
-                results.append(uuid)
-        return results
+        return self._image_data.select(field, lambda value: value.find(sub) >= 0)
 
     def prompt(self, sub: str) -> list:
         return self._search_field('prompt', sub)
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Snapshot.py : Snapshot binari (columnar i mmap-able) del catàleg d'ImageData.
+
+ImageData.save_snapshot() hi escriu totes les imatges i
+ImageData.open_snapshot() el torna a obrir amb mmap: les columnes es llegeixen
+directament de les pàgines de l'arxiu, sense reconstruir cap dict per imatge.
+
+Format (little-endian, versionat):
+    - Capçalera: magic, versió, nombre de files i nombre de seccions
+    - Taula de seccions: (nom, offset, mida) de cada columna
+    - Columnes fixes: arrays (width, height, codis, seed, steps, cfg_scale, ...)
+    - Columnes de text: heap de bytes utf-8 + array d'offsets (n + 1)
+    - uuid.order / file.order: files ordenades per UUID i per path (cerca binària)
+
+Funcions:
+    - write_snapshot(path: str, columns: dict, paths: PathTable) -> None
+        Escriu les columnes de ColumnStore.export() (atòmicament).
+
+Classes:
+    - SnapshotStore(path: str, paths: PathTable)
+        Vista de només lectura amb la mateixa interfície que ColumnStore
+        (store[uuid], column(), select(), value()) i find_file(path).
+
+Notes:
+    - Diversos processos que obren el mateix snapshot comparteixen les
+      mateixes pàgines físiques (page cache)
+    - Obrir-lo només llegeix la capçalera: el cost és independent del nombre d'imatges
+"""
+import bisect
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+from ColumnStore import (Row, DICT_FIELDS, NUMERIC_FIELDS, TEXT_FIELDS,
+                         format_number, is_missing, parse_number, select_numbers, typed_number)
+
+_SNAPSHOT_MAGIC = b"IMSN"
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct("<4sIQI")  # magic, versió, files, seccions
+_SNAPSHOT_SECTION = struct.Struct("<32sQQ")  # nom, offset, mida en bytes
+_ALIGN = 8
+
+
+def _check_byteorder() -> None:
+    # Els arrays s'escriuen i es llegeixen en l'ordre natiu de la màquina
+    if sys.byteorder != "little":
+        raise OSError("Els snapshots d'ImageData només es poden usar en màquines little-endian")
+
+
+def _heap(strings) -> tuple:
+    # (offsets, dades): el string i és dades[offsets[i]:offsets[i + 1]]
+    offsets = array('Q', [0])
+    data = bytearray()
+    for text in strings:
+        if text is not None:
+            data += text.encode("utf-8")
+        offsets.append(len(data))
+    return offsets, data
+
+
+def write_snapshot(path: str, columns: dict, paths) -> None:
+    _check_byteorder()
+    uuids = columns['uuids']
+    files = [paths.path(path_id) for path_id in columns['file']]
+    rows = len(uuids)
+    sections = []  # [(nom, buffer)]
+
+    def add_heap(name, strings):
+        offsets, data = _heap(strings)
+        sections.append((name + ".off", offsets))
+        sections.append((name + ".dat", data))
+
+    add_heap("uuid", uuids)
+    sections.append(("uuid.order", array('I', sorted(range(rows), key=uuids.__getitem__))))
+    add_heap("file", files)
+    sections.append(("file.order", array('I', sorted(range(rows), key=files.__getitem__))))
+    sections.append(("width", columns['width']))
+    sections.append(("height", columns['height']))
+    for field, column in columns['text'].items():
+        add_heap(field, column)
+        sections.append((field + ".null", array('B', (value is None for value in column))))
+    for field, codes in columns['codes'].items():
+        sections.append((field + ".codes", codes))
+        add_heap(field + ".values", columns['values'][field])
+    for field, column in columns['num'].items():
+        raw = columns['raw'][field]
+        sections.append((field, column))
+        raw_rows = sorted(raw)
+        sections.append((field + ".raw.rows", array('I', raw_rows)))
+        add_heap(field + ".raw", (raw[row] for row in raw_rows))
+
+    # Les dades comencen després de la taula de seccions, alineades a 8 bytes
+    offset = _SNAPSHOT_HEADER.size + len(sections) * _SNAPSHOT_SECTION.size
+    table = []
+    for name, buf in sections:
+        offset += -offset % _ALIGN
+        size = len(buf) * (buf.itemsize if isinstance(buf, array) else 1)
+        table.append((name, offset, size))
+        offset += size
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, rows, len(sections)))
+        for name, start, size in table:
+            f.write(_SNAPSHOT_SECTION.pack(name.encode("ascii"), start, size))
+        for (_, buf), (_, start, _) in zip(sections, table):
+            f.write(b"\0" * (start - f.tell()))
+            f.write(buf)
+    # Substitució atòmica: mai queda un snapshot a mig escriure
+    os.replace(tmp, path)
+
+
+def _search(order, key, target) -> int:
+    # bisect_left sobre order comparant key(order[i]); bisect amb key= necessita Python 3.10
+    lo, hi = 0, len(order)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key(order[mid]) < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+class _Heap:
+    """Seqüència de strings guardada com a offsets + bytes utf-8."""
+
+    __slots__ = ('_offsets', '_data')
+
+    def __init__(self, offsets: memoryview, data: memoryview):
+        self._offsets = offsets
+        self._data = data
+
+    def __getitem__(self, i: int) -> str:
+        return str(self._data[self._offsets[i]:self._offsets[i + 1]], "utf-8")
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+
+class SnapshotStore(Mapping):
+
+    def __init__(self, path: str, paths):
+        _check_byteorder()
+        self._path = path
+        self._paths = paths
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mmap)
+        try:
+            magic, version, rows, count = _SNAPSHOT_HEADER.unpack_from(buf, 0)
+            if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+                raise ValueError(f"Snapshot d'ImageData no vàlid: {path}")
+            sections = {}
+            for i in range(count):
+                name, start, size = _SNAPSHOT_SECTION.unpack_from(buf, _SNAPSHOT_HEADER.size + i * _SNAPSHOT_SECTION.size)
+                if start + size > len(buf):
+                    raise ValueError(f"Snapshot d'ImageData truncat: {path}")
+                sections[name.rstrip(b"\0").decode("ascii")] = buf[start:start + size]
+        except (struct.error, ValueError):
+            buf.release()
+            self._mmap.close()
+            raise ValueError(f"Snapshot d'ImageData no vàlid: {path}")
+
+        self._buf = buf
+        self._sections = sections
+        self._rows = rows
+        self._uuids = self._heap("uuid")
+        self._uuid_order = sections["uuid.order"].cast('I')
+        self._files = self._heap("file")
+        self._file_order = sections["file.order"].cast('I')
+        self._width = sections["width"].cast('I')
+        self._height = sections["height"].cast('I')
+        self._text = {field: self._heap(field) for field in TEXT_FIELDS}
+        self._null = {field: sections[field + ".null"] for field in TEXT_FIELDS}
+        self._codes = {field: sections[field + ".codes"].cast('I') for field in DICT_FIELDS}
+        # Pocs valors diferents: es descodifiquen un sol cop (None és el codi 0)
+        self._values = {}
+        for field in DICT_FIELDS:
+            heap = self._heap(field + ".values")
+            self._values[field] = [None] + [heap[code] for code in range(1, len(heap))]
+        self._num = {field: sections[field].cast(code) for field, code in NUMERIC_FIELDS.items()}
+        self._raw_rows = {field: sections[field + ".raw.rows"].cast('I') for field in NUMERIC_FIELDS}
+        self._raw = {field: self._heap(field + ".raw") for field in NUMERIC_FIELDS}
+
+    def _heap(self, name: str) -> _Heap:
+        return _Heap(self._sections[name + ".off"].cast('Q'), self._sections[name + ".dat"])
+
+    def _find(self, uuid: str) -> int:
+        # Cerca binària sobre les files ordenades per UUID
+        order = self._uuid_order
+        i = _search(order, self._uuids.__getitem__, uuid)
+        if i < len(order) and self._uuids[order[i]] == uuid:
+            return order[i]
+        return None
+
+    def _raw_value(self, field: str, row: int):
+        rows = self._raw_rows[field]
+        i = bisect.bisect_left(rows, row)
+        if i < len(rows) and rows[i] == row:
+            return self._raw[field][i]
+        return None
+
+    def _raw_dict(self, field: str) -> dict:
+        # {fila: str} dels valors d'aquest camp guardats com a string
+        heap = self._raw[field]
+        return dict(zip(self._raw_rows[field], (heap[i] for i in range(len(heap)))))
+
+    def _get(self, row: int, field: str):
+        if field == 'dimensions':
+            return (self._width[row] or None, self._height[row] or None)
+        if field == 'file':
+            return self._paths.add(self._files[row])
+        if field in self._codes:
+            return self._values[field][self._codes[field][row]]
+        if field in self._num:
+            raw = self._raw_value(field, row)
+            if raw is not None:
+                return raw
+            value = self._num[field][row]
+            return None if is_missing(field, value) else format_number(field, value)
+        if field in self._text:
+            return None if self._null[field][row] else self._text[field][row]
+        raise KeyError(field)
+
+    def value(self, uuid: str, field: str):
+        row = self._find(uuid)
+        if row is None:
+            raise KeyError(uuid)
+        return self._get(row, field)
+
+    def find_file(self, path: str) -> str:
+        """UUID de la imatge amb aquest path, o None."""
+        order = self._file_order
+        i = _search(order, self._files.__getitem__, path)
+        if i < len(order) and self._files[order[i]] == path:
+            return self._uuids[order[i]]
+        return None
+
+    def column(self, field: str, typed: bool = False):
+        if field in self._num:
+            raw = self._raw_dict(field)
+            if typed:
+                values = (parse_number(field, raw[row]) if row in raw else None if is_missing(field, value)
+                          else typed_number(field, value) for row, value in enumerate(self._num[field]))
+            else:
+                values = (raw[row] if row in raw else None if is_missing(field, value) else format_number(field, value)
+                          for row, value in enumerate(self._num[field]))
+        elif field in self._codes:
+            values = map(self._values[field].__getitem__, self._codes[field])
+        elif field == 'file':
+            values = (self._paths.add(self._files[row]) for row in range(self._rows))
+        else:
+            values = (self._get(row, field) for row in range(self._rows))
+        return zip((self._uuids[row] for row in range(self._rows)), values)
+
+    def select(self, field: str, predicate) -> list:
+        if field in self._codes:
+            # Un sol cop per valor diferent; després només es comparen codis
+            matches = {code for code, value in enumerate(self._values[field])
+                       if value is not None and predicate(value)}
+            if not matches:
+                return []
+            return [self._uuids[row] for row, code in enumerate(self._codes[field]) if code in matches]
+        if field in self._num:
+            rows = select_numbers(field, self._num[field], self._raw_dict(field), predicate)
+            return [self._uuids[row] for row in rows]
+        return [uuid for uuid, value in self.column(field) if value is not None and predicate(value)]
+
+    def close(self) -> None:
+        if self._mmap is None:
+            return
+        # Les vistes (memoryview) sobre el mmap s'alliberen en deixar-les de referenciar
+        self._buf = self._sections = self._uuids = self._uuid_order = None
+        self._files = self._file_order = self._width = self._height = None
+        self._text = self._null = self._codes = self._num = self._raw_rows = self._raw = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # Encara hi ha vistes en ús: el mmap es tancarà quan s'alliberin
+        self._mmap = None
+
+    def __getitem__(self, uuid: str) -> Row:
+        row = self._find(uuid)
+        if row is None:
+            raise KeyError(uuid)
+        return Row(self, row)
+
+    def __contains__(self, uuid) -> bool:
+        return isinstance(uuid, str) and self._find(uuid) is not None
+
+    def __iter__(self):
+        return (self._uuids[row] for row in range(self._rows))
+
+    def __len__(self):
+        return self._rows
+
+    def __str__(self):
+        return f'SnapshotStore: {self._path} ({self._rows} imatges)'
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+UuidRegistry.py : Registre persistent (append-only) dels UUID d'ImageID.
+
+Guarda en un arxiu binari (per defecte cfg.UUID_REGISTRY, al costat de
+ROOT_DIR) cada UUID generat i cada UUID eliminat, en l'ordre en què passen.
+ImageID el reprodueix en arrencar per recuperar el catàleg sense recórrer
+el filesystem.
+
+Funcionalitat:
+    - Afegir events de generació (UUID + path canònic) i d'eliminació (UUID)
+    - Reproduir el registre sencer en arrencar (replay)
+    - Compactar-lo quan els events superen de molt el nombre d'UUID vius
+
+Mètodes:
+    - replay() -> generator
+        Retorna (op, uuid_int, path) per a cada event, en ordre.
+        op és OP_GENERATE o OP_REMOVE (path és None per a OP_REMOVE).
+
+    - append_generate(uuid_int: int, path: str) -> None
+    - append_remove(uuid_int: int) -> None
+        Afegeixen un event al final del registre.
+
+    - needs_compaction(live: int, retired: int = 0) -> bool
+        True si el registre té més del doble dels events que en quedarien
+        després de compactar-lo (un per UUID viu i un per UUID retirat).
+
+    - compact(live: iterable, retired: iterable) -> None
+        Reescriu el registre amb un event per UUID viu ((uuid_int, path)) i
+        un per UUID retirat.
+
+    - flush() -> None
+        Escriu a disc els events pendents.
+
+Notes:
+    - Els UUID es guarden com a 16 bytes; un event incomplet al final de
+      l'arxiu (p.ex. el procés ha mort a mitja escriptura) es descarta
+    - La compactació és atòmica (arxiu temporal + os.replace)
+    - Només hi ha d'escriure un procés alhora
+"""
+import atexit
+import os
+import struct
+import cfg
+
+OP_GENERATE = 1
+OP_REMOVE = 2
+
+# Capçalera (magic, versió) i, per a cada event, op, longitud del path
+# (utf-8, 0 per a OP_REMOVE), UUID (16 bytes) i path
+_REGISTRY_MAGIC = b"IMUL"
+_REGISTRY_VERSION = 1
+_REGISTRY_HEADER = struct.Struct("<4sI")
+_REGISTRY_EVENT = struct.Struct("<BI16s")
+
+
+class UuidRegistry:
+
+    _MIN_EVENTS = 4096  # Per sota d'aquesta mida no val la pena compactar
+
+    def __init__(self, path: str = None):
+        self._path = path or cfg.UUID_REGISTRY
+        self._events = 0
+        self._file = None
+        atexit.register(self.close)
+
+    def _pack(self, op: int, uuid_int: int, path: str = None) -> bytes:
+        data = path.encode("utf-8") if path is not None else b""
+        return _REGISTRY_EVENT.pack(op, len(data), uuid_int.to_bytes(16, "big")) + data
+
+    def replay(self):
+        self._events = 0
+        try:
+            with open(self._path, "rb") as f:
+                data = f.read()
+        except OSError:
+            data = b""
+
+        valid = 0
+        if len(data) >= _REGISTRY_HEADER.size:
+            magic, version = _REGISTRY_HEADER.unpack_from(data, 0)
+            if magic != _REGISTRY_MAGIC or version != _REGISTRY_VERSION:
+                raise ValueError(f"Registre d'UUID no vàlid: {self._path}")
+            offset = valid = _REGISTRY_HEADER.size
+            while offset + _REGISTRY_EVENT.size <= len(data):
+                op, length, raw = _REGISTRY_EVENT.unpack_from(data, offset)
+                end = offset + _REGISTRY_EVENT.size + length
+                if op not in (OP_GENERATE, OP_REMOVE) or end > len(data):
+                    break
+                try:
+                    path = data[offset + _REGISTRY_EVENT.size:end].decode("utf-8") if op == OP_GENERATE else None
+                except UnicodeDecodeError:
+                    break
+                offset = valid = end
+                self._events += 1
+                yield op, int.from_bytes(raw, "big"), path
+
+        # Els events nous s'afegeixen just després de l'últim event sencer
+        self.close()
+        self._file = open(self._path, "r+b" if valid else "wb")
+        if valid:
+            self._file.truncate(valid)
+            self._file.seek(valid)
+        else:
+            self._file.write(_REGISTRY_HEADER.pack(_REGISTRY_MAGIC, _REGISTRY_VERSION))
+
+    def _append(self, event: bytes) -> None:
+        if self._file is None:
+            # No s'ha fet replay(): es continua el registre existent
+            for _ in self.replay():
+                pass
+        self._file.write(event)
+        self._events += 1
+
+    def append_generate(self, uuid_int: int, path: str) -> None:
+        self._append(self._pack(OP_GENERATE, uuid_int, path))
+
+    def append_remove(self, uuid_int: int) -> None:
+        self._append(self._pack(OP_REMOVE, uuid_int))
+
+    def needs_compaction(self, live: int, retired: int = 0) -> bool:
+        # Després de compactar queden live + retired events: si no es
+        # comptessin els retirats, cada event nou tornaria a compactar
+        return self._events > max(2 * (live + retired), self._MIN_EVENTS)
+
+    def compact(self, live, retired) -> None:
+        tmp = self._path + ".tmp"
+        events = 0
+        with open(tmp, "wb") as f:
+            f.write(_REGISTRY_HEADER.pack(_REGISTRY_MAGIC, _REGISTRY_VERSION))
+            for uuid_int, path in live:
+                f.write(self._pack(OP_GENERATE, uuid_int, path))
+                events += 1
+            for uuid_int in retired:
+                f.write(self._pack(OP_REMOVE, uuid_int))
+                events += 1
+        self.close()
+        os.replace(tmp, self._path)
+        self._file = open(self._path, "ab")
+        self._events = events
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __str__(self):
+        return f'UuidRegistry: {self._path} ({self._events} events)'
+
+    def __len__(self):
+        return self._events
@@ -9,6 +9,8 @@ import sys
 import os
 import os.path
 import uuid
+import mmap
+import zlib
 
 
 #############################################################################
@@ -35,6 +37,18 @@ ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), "..","..", "
 #
 IMAGE_DEFAULT = "0b4993aa-093c-42a6-a90a-073dce964bf0.png"
 
+# Cache persistent de metadades (SQLite), al costat de ROOT_DIR
+#
+METADATA_CACHE = ROOT_DIR + ".metadata.sqlite"
+
+# Manifest de l'últim escaneig d'ImageFiles, al costat de ROOT_DIR
+#
+FILES_MANIFEST = ROOT_DIR + ".manifest"
+
+# Registre append-only dels UUID generats i eliminats per ImageID
+#
+UUID_REGISTRY = ROOT_DIR + ".uuids"
+
 # Mode de visualització
 #
 # DISPLAY_MODE = 0  # Només "imprimir per pantalla" metadades (sense mostrar imatge)
@@ -105,17 +119,134 @@ def get_one_file(mode: int = 0) -> str:
     return file
 
 
-def read_png_metadata(filename):
+class PngMetadata(dict):
+    """
+    Diccionari de metadades PNG amb descompressió mandrosa (lazy).
+
+    Els chunks zTXt i els iTXt comprimits es guarden com a bytes comprimits i
+    només es descomprimeixen (zlib) el primer cop que es demana la seva clau
+    amb [], get() o in. Un cop descomprimits, queden com una entrada normal.
+
+    Notes:
+        - keys(), items(), len() i la iteració només inclouen les entrades ja
+          descomprimides; compressed_keys() retorna les pendents
+        - Si un text comprimit està corrupte, la clau es descarta
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._compressed = {}  # keyword -> (bytes comprimits, encoding)
+
+    def add_compressed(self, keyword, data, encoding):
+        if not dict.__contains__(self, keyword):
+            self._compressed[keyword] = (data, encoding)
+
+    def compressed_keys(self):
+        return list(self._compressed)
+
+    def compressed_items(self):
+        return list(self._compressed.items())
+
+    def _inflate(self, keyword):
+        data, encoding = self._compressed.pop(keyword)
+        try:
+            text = zlib.decompress(data).decode(encoding, errors="ignore")
+        except zlib.error:
+            return False
+        dict.__setitem__(self, keyword, text)
+        return True
+
+    def __missing__(self, keyword):
+        if keyword in self._compressed and self._inflate(keyword):
+            return dict.__getitem__(self, keyword)
+        raise KeyError(keyword)
+
+    def __contains__(self, keyword):
+        if dict.__contains__(self, keyword):
+            return True
+        return keyword in self._compressed and self._inflate(keyword)
+
+    def __setitem__(self, keyword, value):
+        self._compressed.pop(keyword, None)
+        dict.__setitem__(self, keyword, value)
+
+    def __bool__(self):
+        return dict.__len__(self) > 0 or bool(self._compressed)
+
+    def get(self, keyword, default=None):
+        return self[keyword] if keyword in self else default
+
+    def __reduce__(self):
+        # Necessari per enviar-lo a un altre procés (pickle)
+        return (self.__class__, (dict(self),), {"_compressed": dict(self._compressed)})
+
+
+def _skip_bytes(f, n):
+    """Avança n bytes: amb seek() si és possible, llegint i descartant si no (streams)."""
+    try:
+        f.seek(n, os.SEEK_CUR)
+    except (AttributeError, OSError):
+        while n > 0:
+            data = f.read(min(n, 1 << 16))
+            if not data:
+                break
+            n -= len(data)
+
+
+def _walk_png_chunks(f, parse_types, headers_only=False):
+    """
+    Recorre els chunks d'un PNG obert (ja situat després de la signatura).
+
+    Només llegeix les dades dels chunks amb tipus dins parse_types; la resta
+    (p.ex. els IDAT de diversos MB) se salten amb seek() sense llegir-los.
+    Si headers_only és True, s'atura al primer IDAT: els chunks de text
+    posteriors a les dades de la imatge s'ignoren.
+
+    Yields:
+        tuple: (chunk_type, chunk_data) per a cada chunk de parse_types
+    """
+    while True:
+        # Length (4 bytes, big-endian) + tipus (4 bytes ASCII) en una sola lectura
+        header = f.read(8)
+        if len(header) < 8:
+            break  # EOF
+
+        length = int.from_bytes(header[:4], byteorder="big")
+        chunk_type = header[4:]
+
+        if chunk_type == b"IEND":
+            break
+        if headers_only and chunk_type == b"IDAT":
+            break
+
+        if chunk_type in parse_types:
+            chunk_data = f.read(length)
+            if len(chunk_data) < length:
+                break  # EOF inesperat
+            # Saltem el CRC (4 bytes), no el validem
+            _skip_bytes(f, 4)
+            yield chunk_type, chunk_data
+        else:
+            # Saltem dades + CRC sense llegir-les
+            _skip_bytes(f, length + 4)
+
+
+def read_png_metadata(filename, headers_only=False):
     """
     Llegeix les metadades embegudes en un arxiu PNG.
 
-    Suporta chunks tEXt i iTXt (Unicode).
+    Suporta chunks tEXt, iTXt (Unicode) i zTXt. Els textos comprimits es
+    descomprimeixen només quan es demana la seva clau (veure PngMetadata).
+    Els chunks que no són de text se salten amb seek() sense llegir-ne les dades.
 
     Args:
         filename (str): Path a l'arxiu PNG
+        headers_only (bool): Si és True, deixa de llegir al primer chunk IDAT.
+              Els chunks de text situats després de les dades de la imatge
+              s'ignoren, a canvi de llegir només uns centenars de bytes.
 
     Returns:
-        dict: Diccionari amb les metadades. Retorna {} si no n'hi ha.
+        PngMetadata: Diccionari amb les metadades. Buit si no n'hi ha.
               Si hi ha error, retorna None.
 
     Exemple:
@@ -125,7 +256,8 @@ def read_png_metadata(filename):
             model = metadata.get('Model', 'None')
     """
     PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
-    metadata = {}
+    TEXT_CHUNKS = (b"tEXt", b"iTXt", b"zTXt")
+    metadata = PngMetadata()
 
     try:
         with open(filename, "rb") as f:
@@ -135,82 +267,9 @@ def read_png_metadata(filename):
                 print(f"ERROR: {filename} no és un PNG vàlid")
                 return None
 
-            # Llegir chunks
-            while True:
-                # Llegir length del chunk (4 bytes, big-endian)
-                length_bytes = f.read(4)
-                if len(length_bytes) < 4:
-                    break  # EOF
-
-                length = int.from_bytes(length_bytes, byteorder="big")
-
-                # Llegir tipus del chunk (4 bytes ASCII)
-                chunk_type_bytes = f.read(4)
-                if len(chunk_type_bytes) < 4:
-                    break
-
-                chunk_type = chunk_type_bytes.decode("ascii", errors="ignore")
-
-                # Llegir dades del chunk
-                if length > 0:
-                    chunk_data = f.read(length)
-                    if len(chunk_data) < length:
-                        break  # EOF inesperat
-                else:
-                    chunk_data = b""
-
-                # Llegir CRC (4 bytes) - no el validem però l'hem de saltar
-                crc = f.read(4)
-                if len(crc) < 4:
-                    break
-
-                # Processar chunks de text
-                if chunk_type == "tEXt":
-                    # Format: keyword\0text
-                    try:
-                        null_pos = chunk_data.index(b"\x00")
-                        keyword = chunk_data[:null_pos].decode("latin-1")
-                        text = chunk_data[null_pos + 1 :].decode("latin-1")
-                        metadata[keyword] = text
-                    except (ValueError, UnicodeDecodeError) as e:
-                        # Si hi ha error, ignorem aquest chunk
-                        pass
-
-                elif chunk_type == "iTXt":
-                    # Format: keyword\0compression_flag\0compression_method\0language\0translated_keyword\0text
-                    try:
-                        null_pos = chunk_data.index(b"\x00")
-                        keyword = chunk_data[:null_pos].decode("latin-1")
-                        rest = chunk_data[null_pos + 1 :]
-
-                        # Saltem compression flag (1 byte) i compression method (1 byte)
-                        if len(rest) >= 2:
-                            compression_flag = rest[0]
-                            rest = rest[2:]
-
-                            # Saltem language tag (fins al següent \0)
-                            if b"\x00" in rest:
-                                null_pos = rest.index(b"\x00")
-                                rest = rest[null_pos + 1 :]
-
-                                # Saltem translated keyword (fins al següent \0)
-                                if b"\x00" in rest:
-                                    null_pos = rest.index(b"\x00")
-                                    text_data = rest[null_pos + 1 :]
-
-                                    # Si està comprimit, no el processem (necessitaria zlib)
-                                    if compression_flag == 0:
-                                        text = text_data.decode(
-                                            "utf-8", errors="ignore"
-                                        )
-                                        metadata[keyword] = text
-                    except (ValueError, UnicodeDecodeError) as e:
-                        # Si hi ha error, ignorem aquest chunk
-                        pass
-
-                # Si trobem IEND, hem acabat
-                elif chunk_type == "IEND":
-                    break
+            # Llegir només els chunks de text
+            for chunk_type, chunk_data in _walk_png_chunks(f, TEXT_CHUNKS, headers_only):
+                _parse_text_chunk(chunk_data, chunk_type, 0, len(chunk_data), metadata)
 
         return metadata
 
@@ -225,6 +284,47 @@ def read_png_metadata(filename):
         return None
 
 
+def read_png_stream(f, headers_only=False):
+    """
+    Llegeix metadades i dimensions d'un PNG a partir d'un objecte file binari.
+
+    Pensat per a streams que no són arxius del disc (p.ex. membres d'un tar o
+    d'un zip): no cal que el stream permeti seek(). Només es llegeixen les
+    dades dels chunks IHDR, tEXt, iTXt i zTXt.
+
+    Args:
+        f: Objecte file binari situat a l'inici del PNG
+        headers_only (bool): Si és True, s'atura al primer chunk IDAT
+
+    Returns:
+        tuple: (metadata, (width, height)). Si no és un PNG vàlid o hi ha
+               error, retorna (None, (None, None)).
+    """
+    PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+    PARSE_CHUNKS = (b"IHDR", b"tEXt", b"iTXt", b"zTXt")
+    metadata = PngMetadata()
+    dimensions = (None, None)
+
+    try:
+        if f.read(8) != PNG_SIGNATURE:
+            return None, (None, None)
+
+        for chunk_type, chunk_data in _walk_png_chunks(f, PARSE_CHUNKS, headers_only):
+            if chunk_type == b"IHDR":
+                if len(chunk_data) >= 8:
+                    width = int.from_bytes(chunk_data[0:4], byteorder="big")
+                    height = int.from_bytes(chunk_data[4:8], byteorder="big")
+                    dimensions = (width, height)
+            else:
+                _parse_text_chunk(chunk_data, chunk_type, 0, len(chunk_data), metadata)
+
+        return metadata, dimensions
+
+    except Exception as e:
+        print(f"ERROR llegint stream PNG: {e}")
+        return None, (None, None)
+
+
 def get_png_dimensions(filename):
     """
     Llegeix les dimensions d'un arxiu PNG del chunk IHDR.
@@ -264,3 +364,124 @@ def get_png_dimensions(filename):
     except Exception as e:
         print(f"ERROR llegint dimensions de {filename}: {e}")
         return (None, None)
+
+
+
+def _parse_text_chunk(buf, chunk_type, start, end, metadata):
+    """
+    Interpreta un chunk tEXt/iTXt/zTXt que ocupa buf[start:end] i l'afegeix a metadata.
+
+    buf pot ser un bytes o un mmap (qualsevol objecte amb find() i buffer),
+    així evitem copiar les dades del chunk.
+    """
+    view = memoryview(buf)
+    try:
+        null_pos = buf.find(b"\x00", start, end)
+        if null_pos < 0:
+            return
+        keyword = str(view[start:null_pos], "latin-1")
+
+        if chunk_type == b"tEXt":
+            # Format: keyword\0text
+            metadata[keyword] = str(view[null_pos + 1 : end], "latin-1")
+
+        elif chunk_type == b"iTXt":
+            # Format: keyword\0compression_flag compression_method language\0translated_keyword\0text
+            pos = null_pos + 1
+            if end - pos < 2:
+                return
+            compression_flag = buf[pos]
+            pos += 2
+            null_pos = buf.find(b"\x00", pos, end)  # language tag
+            if null_pos < 0:
+                return
+            null_pos = buf.find(b"\x00", null_pos + 1, end)  # translated keyword
+            if null_pos < 0:
+                return
+            if compression_flag == 0:
+                metadata[keyword] = str(view[null_pos + 1 : end], "utf-8", "ignore")
+            elif isinstance(metadata, PngMetadata):
+                # Comprimit: es guarda tal qual i es descomprimeix si es demana
+                metadata.add_compressed(keyword, bytes(view[null_pos + 1 : end]), "utf-8")
+
+        elif chunk_type == b"zTXt":
+            # Format: keyword\0compression_method compressed_text (latin-1)
+            if isinstance(metadata, PngMetadata) and end - null_pos >= 2:
+                metadata.add_compressed(keyword, bytes(view[null_pos + 2 : end]), "latin-1")
+    except (ValueError, UnicodeDecodeError):
+        # Si hi ha error, ignorem aquest chunk
+        pass
+    finally:
+        view.release()
+
+
+def read_png_info(filename, headers_only=False):
+    """
+    Llegeix en una sola passada les metadades i les dimensions d'un arxiu PNG.
+
+    Mapeja l'arxiu a memòria (mmap) un únic cop i recorre la taula de chunks
+    sense copiar-ne les dades. Equival a cridar read_png_metadata() i
+    get_png_dimensions() però obrint l'arxiu una sola vegada.
+
+    Args:
+        filename (str): Path a l'arxiu PNG
+        headers_only (bool): Si és True, s'atura al primer chunk IDAT
+              (veure read_png_metadata).
+
+    Returns:
+        tuple: (metadata, (width, height)). metadata és {} si no n'hi ha.
+               Si hi ha error, retorna (None, (None, None)).
+
+    Exemple:
+        metadata, (width, height) = read_png_info("image.png")
+    """
+    PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+    metadata = PngMetadata()
+    dimensions = (None, None)
+
+    try:
+        with open(filename, "rb") as f:
+            if os.fstat(f.fileno()).st_size < len(PNG_SIGNATURE):
+                print(f"ERROR: {filename} no és un PNG vàlid")
+                return None, (None, None)
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[:8] != PNG_SIGNATURE:
+                    print(f"ERROR: {filename} no és un PNG vàlid")
+                    return None, (None, None)
+
+                size = len(mm)
+                pos = 8
+                while pos + 8 <= size:
+                    length = int.from_bytes(mm[pos : pos + 4], byteorder="big")
+                    chunk_type = mm[pos + 4 : pos + 8]
+                    start = pos + 8
+                    end = start + length
+                    if end + 4 > size:
+                        break  # EOF inesperat
+
+                    if chunk_type == b"IHDR" and length >= 8:
+                        width = int.from_bytes(mm[start : start + 4], byteorder="big")
+                        height = int.from_bytes(mm[start + 4 : start + 8], byteorder="big")
+                        dimensions = (width, height)
+                    elif chunk_type in (b"tEXt", b"iTXt", b"zTXt"):
+                        _parse_text_chunk(mm, chunk_type, start, end, metadata)
+                    elif chunk_type == b"IEND":
+                        break
+                    elif headers_only and chunk_type == b"IDAT":
+                        break
+
+                    # Saltem dades + CRC (4 bytes)
+                    pos = end + 4
+
+        return metadata, dimensions
+
+    except FileNotFoundError:
+        print(f"ERROR: Arxiu {filename} no trobat")
+        return None, (None, None)
+    except (IOError, ValueError) as e:
+        print(f"ERROR llegint {filename}: {e}")
+        return None, (None, None)
+    except Exception as e:
+        print(f"ERROR inesperat processant {filename}: {e}")
+        return None, (None, None)
@@ -125,19 +125,19 @@ def generate_ground_truth():
     
     image_data = ImageData()
     image_id = ImageID()
-    count = 0
-    for img_path in image_files:
+    uuids = []
+    # Generate all UUIDs in one batch instead of one call per image
+    for img_path, uuid in zip(image_files, image_id.generate_uuids(image_files)):
         try:
-            # We need relative path for ImageID?
-            # cfg.get_canonical_pathfile might be needed
-            # But let's just try using the path we have
-            uuid = image_id.generate_uuid(img_path)
             if uuid:
                 image_data.add_image(uuid, img_path)
-                image_data.load_metadata(uuid)
-                count += 1
+                uuids.append(uuid)
         except Exception as e:
             pass
+
+    # Parse all PNG headers in parallel instead of one by one
+    image_data.load_all_metadata(uuids, workers=os.cpu_count(), backend="thread")
+    count = len(uuids)
             
     print(f"Loaded metadata for {count} images.")
     
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+test_ingestion.py : Proves de regressió de la ingesta asíncrona (Ingestion.py).
+
+Comproven que ingest() s'atura (sense penjar el loop) quan el pipeline acaba
+abans d'hora: una lectura que falla o una cancel·lació a mig recorregut.
+
+Execució:
+    python -m pytest -q test_ingestion.py
+"""
+import asyncio
+import threading
+import time
+import unittest
+
+from Ingestion import ingest
+
+_TIMEOUT = 10  # Segons: si ingest() es penja, la prova falla en lloc de bloquejar-se
+
+
+class _Files:
+    """ImageFiles mínim: reload_fs_iter() retorna n arxius."""
+
+    def __init__(self, n: int):
+        self.n = n
+        self.walked = 0
+
+    def reload_fs_iter(self, path: str = None):
+        for i in range(self.n):
+            self.walked += 1
+            yield f"img_{i:05d}.png"
+
+
+class _ID:
+    def generate_uuid(self, file: str) -> str:
+        return "uuid-" + file
+
+
+class _Data:
+    """ImageData mínim: read_metadata() espera 'delay' i falla a la lectura 'fail_at'."""
+
+    def __init__(self, delay: float = 0.0, fail_at: int = None):
+        self.delay = delay
+        self.fail_at = fail_at
+        self.reads = 0
+        self.stored = []
+        self._lock = threading.Lock()
+
+    def add_image(self, uuid: str, file: str) -> None:
+        pass
+
+    def read_metadata(self, uuid: str) -> tuple:
+        with self._lock:
+            self.reads += 1
+            n = self.reads
+        if n == self.fail_at:
+            raise RuntimeError("lectura fallida")
+        time.sleep(self.delay)
+        return {}, (None, None)
+
+    def store_metadata(self, uuid: str, metadata: dict, dimensions: tuple) -> None:
+        self.stored.append(uuid)
+
+
+def _run(coroutine_factory):
+    # Executa la coroutine en un thread a part amb límit de temps
+    outcome = {}
+
+    def target():
+        try:
+            outcome['result'] = asyncio.run(coroutine_factory())
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    start = time.monotonic()
+    thread.start()
+    thread.join(_TIMEOUT)
+    if thread.is_alive():
+        raise AssertionError("ingest() no s'ha aturat")
+    return outcome, time.monotonic() - start
+
+
+class TestIngestStops(unittest.TestCase):
+
+    def test_complete(self):
+        data = _Data()
+        outcome, _ = _run(lambda: ingest(_Files(100), _ID(), data, concurrency=4, batch_size=7))
+        self.assertEqual(len(outcome['result']), 100)
+        self.assertEqual(len(data.stored), 100)
+
+    def test_reader_error(self):
+        files, data = _Files(3000), _Data(delay=0.001, fail_at=5)
+
+        async def main():
+            return await asyncio.wait_for(ingest(files, _ID(), data, concurrency=4), 5)
+
+        outcome, elapsed = _run(main)
+        self.assertIsInstance(outcome.get('error'), RuntimeError)
+        self.assertLess(elapsed, 5)
+        # Després de l'error ningú no continua llegint ni modificant image_data
+        reads, stored = data.reads, len(data.stored)
+        time.sleep(0.3)
+        self.assertEqual((data.reads, len(data.stored)), (reads, stored))
+        self.assertLess(files.walked, files.n)
+
+    def test_cancel(self):
+        files, data = _Files(3000), _Data(delay=0.005)
+
+        async def main():
+            task = asyncio.ensure_future(ingest(files, _ID(), data, concurrency=4))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            try:
+                await asyncio.wait_for(task, 5)
+            except asyncio.CancelledError:
+                return "cancelled"
+
+        outcome, elapsed = _run(main)
+        self.assertEqual(outcome.get('result'), "cancelled")
+        self.assertLess(elapsed, 5)
+        walked = files.walked
+        time.sleep(0.3)
+        self.assertEqual(files.walked, walked)
+        self.assertLess(walked, files.n)
+
+
+if __name__ == "__main__":
+    unittest.main()